@@ -0,0 +1,202 @@
+'''
+Solve a batch of screenshots: every image of a directory, or the (puzzle type, image) pairs of a manifest.
+
+Unlike runner_all.py, which runs the whole runner (and loads the path cache) once per image, the path caches are
+loaded once per process and the images are parsed and solved in a pool of worker processes. One JSON record per image
+(cells, broken edges, solutions, timings or the error) is written to the output file, in input order.
+
+    python batch.py --dir img/triangles --puzzle-type Triangle --workers 4
+    python batch.py --manifest regression.csv --output results.jsonl
+    python batch.py                  # the images of runner_all.FILE_AND_TYPE
+
+A manifest has one `puzzle_type,image` line per image. Image paths are relative to the manifest's directory. Blank
+lines and lines starting with # are skipped.
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from PIL import Image
+import cfg
+import bitgrid
+import cache_manager
+import region_index
+import runner
+import spans
+import tri_index
+from spans import span
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.bmp')
+
+Job = tuple[str, str]  # (puzzle type, image path)
+
+
+@dataclass
+class SolveRecord:
+    image: str
+    puzzle_type: str
+    cells: list[list[str]] = field(default_factory=list)
+    broken_edges: list[list[list[int]]] = field(default_factory=list)  # [[x, y], [x, y]] per edge, sorted
+    solutions: list[list[list[int]]] = field(default_factory=list)  # points of each answer path
+    timings: dict[str, float] = field(default_factory=dict)  # seconds per step ('proc img > solve', ...) and 'total'
+    error: str | None = None
+
+
+def read_manifest(manifest_file: str) -> list[Job]:
+    '''Return the (puzzle type, image path) pairs of a manifest'''
+    base = Path(manifest_file).parent
+    jobs = []
+    for line in Path(manifest_file).read_text().splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        puzzle_type, image = (part.strip() for part in line.split(',', 1))
+        if puzzle_type not in cfg.PUZZLE_TYPES:
+            raise RuntimeError(f'Unknown puzzle_type in {manifest_file}: {puzzle_type}')
+        jobs.append((puzzle_type, str(base / image)))
+    return jobs
+
+
+def scan_dir(image_dir: str, puzzle_type: str) -> list[Job]:
+    '''Return a job for every image in a directory, sorted by name'''
+    return [(puzzle_type, str(path)) for path in sorted(Path(image_dir).iterdir())
+            if path.suffix.lower() in IMAGE_SUFFIXES]
+
+
+# Cache manager of this process. Set up once per worker by _init_worker(), then used by every image it solves.
+_caches: cache_manager.CacheManager | None = None
+_quiet = True
+
+
+def _init_worker(cache_dir: str | None, max_bytes: int, backend: str, quiet: bool):
+    global _caches, _quiet
+    cfg.SHOW_DEBUG_IMG = False
+    cfg.GRID_BACKEND = backend
+    _caches = None if cache_dir is None else cache_manager.CacheManager(cache_dir, max_bytes)
+    _quiet = quiet
+
+
+def _solve(job: Job) -> SolveRecord:
+    '''Parse and solve one image. The solver's output is dropped (in quiet mode), errors go into the record.'''
+    puzzle_type, image = job
+    record = SolveRecord(image, puzzle_type)
+    spans.TRACER.reset()
+    start = time.perf_counter()
+    output = io.StringIO() if _quiet else None
+    try:
+        with contextlib.redirect_stdout(output) if _quiet else contextlib.nullcontext():
+            cfg.config_factory(puzzle_type)
+            with span('load img'):
+                with Image.open(image) as img:
+                    img.load()
+            with span('proc img'):
+                cells, broken_edges, paths = runner.solve_image(img, _caches)
+        record.cells = [list(row) for row in cells]
+        record.broken_edges = sorted(sorted(list(pt) for pt in edge) for edge in broken_edges)
+        record.solutions = [[list(pt) for pt in path] for path in paths]
+    except Exception as exc:
+        record.error = ''.join(traceback.format_exception(exc))
+    for event in spans.TRACER.events:
+        name = ' > '.join(event.path)
+        record.timings[name] = record.timings.get(name, 0.0) + event.wall
+    record.timings['total'] = time.perf_counter() - start
+    return record
+
+
+def prepare_caches(jobs: list[Job], cache_dir: str, workers: int) -> None:
+    '''Build the path cache files and their index files the jobs need, so no worker has to. Nothing is loaded if they
+    exist.'''
+    caches = cache_manager.CacheManager(cache_dir, workers=workers)
+    sizes = set()
+    for puzzle_type, _ in jobs:
+        with contextlib.redirect_stdout(io.StringIO()):
+            cfg.config_factory(puzzle_type)
+        sizes.add(cfg.Puzzle.GRID_SIZE)
+    for width, height in sorted(sizes):
+        cache_file = caches.cache_file(caches.make_key(width, height))
+        index_files = (tri_index.index_file_for(cache_file), region_index.index_file_for(cache_file))
+        if not caches.available(width, height) or not all(Path(f).exists() for f in index_files):
+            print(f'Building the path cache for {width}x{height} grids')
+            entry = caches.get(width, height)
+            entry.tri_idx, entry.region_idx  # wait for the index files to be written too
+
+
+def run_batch(jobs: list[Job], workers: int = 0, cache_dir: str | None = '.', max_bytes: int | None = None,
+              backend: str = cfg.GRID_BACKEND, output: str | None = None, quiet: bool = True) -> list[SolveRecord]:
+    '''Solve every job and return the records, in job order. `workers` = 0 solves them in this process.
+    With `cache_dir` None, paths are streamed for every image instead of loaded from the path caches.'''
+    if cache_dir is not None:
+        prepare_caches(jobs, cache_dir, cfg.PATH_WORKERS)
+    max_bytes = cfg.CACHE_BUDGET_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    init_args = (cache_dir, max_bytes, backend, quiet)
+
+    records = []
+    out = open(output, 'w') if output else None
+    start = time.perf_counter()
+    try:
+        if workers:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=init_args) as pool:
+                for record in pool.map(_solve, jobs):
+                    records.append(_report(record, len(records), len(jobs), out))
+        else:
+            _init_worker(*init_args)
+            for job in jobs:
+                records.append(_report(_solve(job), len(records), len(jobs), out))
+    finally:
+        if out is not None:
+            out.close()
+    elapsed = time.perf_counter() - start
+
+    failed = sum(1 for r in records if r.error)
+    print(f'Solved {len(records) - failed} of {len(records)} images in {elapsed:.3f}s '
+          f'({len(records) / elapsed:.2f} images/s, {workers or 1} process{"es" if workers > 1 else ""})')
+    return records
+
+
+def _report(record: SolveRecord, idx: int, total: int, out) -> SolveRecord:
+    status = f'ERROR {record.error.strip().splitlines()[-1]}' if record.error else f'{len(record.solutions)} solutions'
+    print(f'#{idx + 1}/{total} {record.image} ({record.puzzle_type}): {status} in {record.timings["total"]:.3f}s')
+    if out is not None:
+        out.write(json.dumps(asdict(record)) + '\n')
+        out.flush()
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Solve a batch of screenshots')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--dir', help='Solve every image in this directory (needs --puzzle-type)')
+    source.add_argument('--manifest', help='File of `puzzle_type,image` lines to solve')
+    parser.add_argument('--puzzle-type', choices=cfg.PUZZLE_TYPES, help='Type of the puzzles in --dir')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes. 0 = solve in this process.')
+    parser.add_argument('--output', default='batch_results.jsonl', help='File for the JSON record of each image')
+    parser.add_argument('--cache-dir', default='.', help='Directory of the path caches')
+    parser.add_argument('--cache-budget-mb', type=int, default=cfg.CACHE_BUDGET_MB, help='Memory the path caches of each worker may hold')
+    parser.add_argument('--no-cache', action='store_true', help='Stream paths for each image instead of loading the path caches')
+    parser.add_argument('--backend', choices=bitgrid.GRID_BACKENDS, default=cfg.GRID_BACKEND, help='Grid implementation to solve with')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of each solve')
+    args = parser.parse_args()
+
+    if args.dir:
+        if args.puzzle_type is None:
+            raise Exception('Must provide --puzzle-type if you provide --dir')
+        jobs = scan_dir(args.dir, args.puzzle_type)
+    elif args.manifest:
+        jobs = read_manifest(args.manifest)
+    else:
+        import runner_all
+        jobs = [(puzzle_type, 'img/' + name) for puzzle_type, name in runner_all.FILE_AND_TYPE]
+
+    run_batch(jobs, args.workers, None if args.no_cache else args.cache_dir, args.cache_budget_mb * 1024 * 1024,
+              args.backend, args.output, not args.verbose)
+    print(f'Records written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
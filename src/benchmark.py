@@ -0,0 +1,204 @@
+'''
+Micro-benchmarks of the solver's hot spots on 3x3 to 6x6 grids, with the demo puzzles of puzzle.py as standard inputs
+(their 4x4 cell layouts are tiled or cropped to fit each size).
+
+Every benchmark runs a fixed amount of work several times (looped when one call is too short to time well). The median
+and spread of the runs are written as JSON, and compared against a stored baseline. A benchmark whose fastest run is
+still slower than the baseline median by more than the tolerance fails the run (exit status 1). Gating on the fastest
+run keeps a noisy machine from failing the suite, while a real slowdown moves every run. Timings only compare on the
+machine and Python version they were recorded with, so a baseline from anywhere else fails the run too, and has to be
+recorded again on this machine.
+
+    python benchmark.py                         # run, compare against benchmark_baseline.json (next to this file)
+    python benchmark.py --update-baseline       # run and store the results as the new baseline
+    python benchmark.py --sizes 3 4 --runs 3 --output results.json
+'''
+import argparse
+import contextlib
+import gc
+import io
+import itertools
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+import puzzle
+from typ import CellGrid, PointPair
+
+SIZES = (3, 4, 5, 6)
+RUNS = 5
+TOLERANCE = 0.25  # a fastest run this much slower than the baseline median is a regression
+BASELINE_FILE = str(Path(__file__).with_name('benchmark_baseline.json'))
+MAX_ENUM_SIZE = 5  # find_all_paths() and calc_paths() enumerate every partial path, which is out of reach beyond 5x5
+CANDIDATES = 2000  # complete paths each checker benchmark runs over
+MIN_RUN_TIME = 0.05  # fast benchmarks are looped until one run takes at least this long, to keep timer noise down
+
+
+@dataclass
+class Benchmark:
+    name: str
+    size: int
+    run: Callable[[], object]
+
+    @property
+    def key(self) -> str:
+        return f'{self.name}/{self.size}x{self.size}'
+
+
+def fit_cells(cells: CellGrid, size: int) -> CellGrid:
+    '''Tile or crop a cell layout to the cells of a size x size grid'''
+    return tuple(tuple(cells[y % len(cells)][x % len(cells[0])] for x in range(size - 1)) for y in range(size - 1))
+
+
+def fit_edges(edges: set[PointPair], size: int) -> set[PointPair]:
+    '''The edges that lie inside a size x size grid'''
+    return {edge for edge in edges if all(x < size and y < size for x, y in edge)}
+
+
+def candidates(size: int) -> list[puzzle.Grid]:
+    '''The first CANDIDATES complete paths of a size x size grid, in search order'''
+    return list(itertools.islice(puzzle.Grid(size, size).iter_paths(), CANDIDATES))
+
+
+def make_benchmarks(sizes, cache_dir: str) -> list[Benchmark]:
+    '''Build the inputs of every benchmark. Nothing here is timed.'''
+    benchmarks = []
+    for size in sizes:
+        grid = puzzle.Grid(size, size)
+        grids = candidates(size)
+        tri_cells = [fit_cells(cells, size) for cells in puzzle.DEMO_TRI_CELLS]
+        region_cells = fit_cells(puzzle.DEMO_REGION_CELLS, size)
+        edges_to_del = fit_edges(puzzle.DEMO_REGION_EDGES_TO_DEL, size)
+
+        if size <= MAX_ENUM_SIZE:
+            cache_file = str(Path(cache_dir) / f'grid_{size}x{size}.paths.bin')
+            grid.calc_paths(cache_file)
+            benchmarks.append(Benchmark('find_all_paths', size, lambda grid=grid: grid.find_all_paths(grid.start)))
+            benchmarks.append(Benchmark('calc_paths_load', size, lambda grid=grid, f=cache_file: grid.calc_paths(f)))
+
+        def check_tri(grids=grids, tri_cells=tri_cells):
+            for cells in tri_cells:
+                for g in grids:
+                    g.set_cells(cells)
+                    g.is_solved_tri_puzzle()
+
+        def check_region(grids=grids, cells=region_cells, edges_to_del=edges_to_del):
+            for g in grids:
+                g.set_cells(cells)
+                g.is_solved_region_puzzle(edges_to_del)
+
+        benchmarks.append(Benchmark('is_solved_tri_puzzle', size, check_tri))
+        benchmarks.append(Benchmark('is_solved_region_puzzle', size, check_region))
+        benchmarks.append(Benchmark('get_regions_wrapper', size, lambda grids=grids: [g.get_regions_wrapper() for g in grids]))
+        benchmarks.append(Benchmark('__str__', size, lambda grids=grids: [str(g) for g in grids]))
+    return benchmarks
+
+
+def measure(benchmark: Benchmark, runs: int) -> dict:
+    '''Run a benchmark `runs` times and return the seconds of one call, per run'''
+    def timed(loops: int) -> float:
+        gc.collect()
+        with contextlib.redirect_stdout(io.StringIO()):  # calc_paths() prints on every call
+            s = time.perf_counter()
+            for _ in range(loops):
+                benchmark.run()
+            return time.perf_counter() - s
+
+    loops = 1
+    while timed(loops) < MIN_RUN_TIME:
+        loops *= 2
+    times = [timed(loops) / loops for _ in range(runs)]
+    return {
+        'median': statistics.median(times),
+        'min': min(times),
+        'max': max(times),
+        'stdev': statistics.stdev(times) if runs > 1 else 0.0,
+        'loops': loops,
+        'runs': times,
+    }
+
+
+def run_suite(sizes=SIZES, runs: int = RUNS, only: list[str] | None = None) -> dict:
+    '''Run the benchmarks (all, or those named in `only`) and return the JSON-ready results'''
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for benchmark in make_benchmarks(sizes, cache_dir):
+            if only and benchmark.name not in only:
+                continue
+            results[benchmark.key] = measure(benchmark, runs)
+            r = results[benchmark.key]
+            print(f'{benchmark.key:<32}{r["median"]:>10.4f}s median  ({r["min"]:.4f}s - {r["max"]:.4f}s)')
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'runs': runs,
+        'candidates': CANDIDATES,
+        'results': results,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list[str]:
+    '''Print the change of each benchmark's median against the baseline. Return the benchmarks that regressed: those
+    whose fastest run is slower than the baseline median by more than `tolerance`. Raises RuntimeError if the baseline
+    was recorded on another platform or Python version.'''
+    for field in ('platform', 'python'):
+        if baseline.get(field) != results[field]:
+            raise RuntimeError(f'Baseline recorded on {field} {baseline.get(field)}, this is {results[field]}. '
+                               f'Re-record the baseline here with --update-baseline.')
+    regressions = []
+    print(f'{"benchmark":<32}{"baseline":>11}{"now":>11}{"change":>9}')
+    for key, r in results['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            print(f'{key:<32}{"-":>11}{r["median"]:>10.4f}s  (new)')
+            continue
+        change = r['median'] / base['median'] - 1
+        flag = ''
+        if r['min'] > base['median'] * (1 + tolerance):
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print(f'{key:<32}{base["median"]:>10.4f}s{r["median"]:>10.4f}s{change:>+9.0%}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Solver micro-benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='grid sizes to run')
+    parser.add_argument('--runs', type=int, default=RUNS, help='runs per benchmark')
+    parser.add_argument('--only', nargs='+', help='names of the benchmarks to run (ex: find_all_paths __str__)')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='JSON results to compare against')
+    parser.add_argument('--update-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='fail if the fastest run is slower than the baseline median by more than this fraction')
+    args = parser.parse_args()
+
+    baseline_file = Path(args.baseline)
+    if not args.update_baseline and not baseline_file.exists():
+        sys.exit(f'No baseline at {args.baseline}, run with --update-baseline to store one')
+
+    results = run_suite(args.sizes, args.runs, args.only)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.update_baseline:
+        baseline_file.write_text(json.dumps(results, indent=2))
+        print(f'Baseline written to {args.baseline}')
+        return
+
+    try:
+        regressions = compare(results, json.loads(baseline_file.read_text()), args.tolerance)
+    except RuntimeError as exc:
+        sys.exit(str(exc))
+    if regressions:
+        print(f'{len(regressions)} benchmark(s) with every run slower than the baseline median by more than '
+              f'{args.tolerance:.0%}: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
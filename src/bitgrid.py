@@ -0,0 +1,319 @@
+# Grid backend that stores the edges of a path and the visited points as integer bitmasks
+import functools
+import itertools
+import time
+from collections.abc import MutableMapping
+from typing import Iterator, TYPE_CHECKING
+import cfg
+import puzzle
+from typ import Point, PointPair, PointPath
+if TYPE_CHECKING:
+    from constraints import PathConstraint
+
+
+class EdgeTable:
+    '''Fixed lookup tables for a grid of a given size. Every edge and point gets a bit index. Shared by all BitGrids of
+    the same size (see edge_table()).'''
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.edges: list[PointPair] = list(puzzle.Grid.enumerate_all_edges(width, height))
+        self.edge_bit: dict[PointPair, int] = {edge: 1 << idx for idx, edge in enumerate(self.edges)}
+        self.all_edges: int = (1 << len(self.edges)) - 1
+        self.point_bit: dict[Point, int] = {(x, y): 1 << (y * width + x) for y in range(height) for x in range(width)}
+
+        # (hop, edge bit, hop bit) for every move out of a point, in the same RIGHT, DOWN, LEFT, UP order as valid_moves()
+        self.moves: dict[Point, tuple[tuple[Point, int, int], ...]] = {}
+        for pt in self.point_bit:
+            moves = []
+            for d in (cfg.RIGHT, cfg.DOWN, cfg.LEFT, cfg.UP):
+                hop = pt[0] + d[0], pt[1] + d[1]
+                if hop in self.point_bit:
+                    moves.append((hop, self.edge_bit[frozenset((pt, hop))], self.point_bit[hop]))
+            self.moves[pt] = tuple(moves)
+
+        # edge bit for each (point, point) step, in both directions. Avoids building a frozenset per lookup
+        self.step_bit: dict[tuple[Point, Point], int] = {}
+        for edge, bit in self.edge_bit.items():
+            a, b = edge
+            self.step_bit[(a, b)] = bit
+            self.step_bit[(b, a)] = bit
+
+        # Per cell: mask of the 4 surrounding edges
+        self.cell_edges: dict[Point, int] = {}
+        grid = puzzle.Grid(width, height)
+        for y in range(height - 1):
+            for x in range(width - 1):
+                mask = 0
+                for d in (cfg.RIGHT, cfg.UP, cfg.LEFT, cfg.DOWN):
+                    mask |= self.edge_bit[grid.calc_edge((x, y), d)]
+                self.cell_edges[(x, y)] = mask
+
+        # (cell index, neighbour index, edge bit between them) for the right and down neighbour of every cell, as used by
+        # Grid.label_regions()
+        self.cell_links: list[tuple[int, int, int]] = []
+        w = width - 1
+        for y in range(height - 1):
+            for x in range(w):
+                idx = y * w + x
+                if x + 1 < w:
+                    self.cell_links.append((idx, idx + 1, self.edge_bit[grid.calc_edge((x, y), cfg.RIGHT)]))
+                if y + 1 < height - 1:
+                    self.cell_links.append((idx, idx + w, self.edge_bit[grid.calc_edge((x, y), cfg.DOWN)]))
+
+    def edges_mask(self, edges) -> int:
+        '''Convert a collection of PointPairs into an edge bitmask'''
+        mask = 0
+        for e in edges:
+            mask |= self.edge_bit[e]
+        return mask
+
+    def points_mask(self, edge_mask: int) -> int:
+        '''Return the mask of all points touched by the edges in the given edge bitmask'''
+        mask = 0
+        for edge in self.iter_edges(edge_mask):
+            for pt in edge:
+                mask |= self.point_bit[pt]
+        return mask
+
+    def iter_edges(self, edge_mask: int) -> Iterator[PointPair]:
+        while edge_mask:
+            low = edge_mask & -edge_mask
+            yield self.edges[low.bit_length() - 1]
+            edge_mask ^= low
+
+
+@functools.cache
+def edge_table(width: int, height: int) -> EdgeTable:
+    return EdgeTable(width, height)
+
+
+class BitEdges(MutableMapping):
+    '''dict-like view of a BitGrid's edges, so code written against Grid.edges keeps working'''
+    def __init__(self, grid: 'BitGrid'):
+        self.grid = grid
+
+    def _bit(self, pair: PointPair) -> int:
+        bit = self.grid.table.edge_bit.get(pair, 0)
+        if not self.grid.present & bit:
+            raise KeyError(pair)
+        return bit
+
+    def __getitem__(self, pair: PointPair) -> bool:
+        return bool(self.grid.active & self._bit(pair))
+
+    def __setitem__(self, pair: PointPair, state: bool) -> None:
+        g = self.grid
+        bit = g.table.edge_bit[pair]  # only the edges of a full grid can exist
+        g.present |= bit
+        if state:
+            g.active |= bit
+        else:
+            g.active &= ~bit
+        g.visited = g.table.points_mask(g.active)
+
+    def __delitem__(self, pair: PointPair) -> None:
+        g = self.grid
+        bit = self._bit(pair)
+        g.present &= ~bit
+        g.active &= ~bit
+        g.visited = g.table.points_mask(g.active)
+
+    def __iter__(self) -> Iterator[PointPair]:
+        return self.grid.table.iter_edges(self.grid.present)
+
+    def __len__(self) -> int:
+        return self.grid.present.bit_count()
+
+    def __contains__(self, pair) -> bool:
+        return bool(self.grid.present & self.grid.table.edge_bit.get(pair, 0))
+
+    def copy(self) -> dict[PointPair, bool]:
+        return dict(self.items())
+
+
+class BitGrid(puzzle.Grid):
+    '''Grid that keeps existing edges, path edges and visited points as int bitmasks. All lookups go through the
+    precomputed EdgeTable of its size instead of building and hashing frozensets.'''
+    def __init__(self, width, height, start: Point | None = None, end: Point | None = None):
+        self.width: int = width
+        self.height: int = height
+        self.start: Point = (0, height - 1) if start is None else start
+        self.end: Point = (width - 1, 0) if end is None else end
+        self.path: PointPath = [self.start]
+        self.cells: tuple[tuple[str]] | None = None
+        self.table: EdgeTable = edge_table(width, height)
+        self.present: int = self.table.all_edges  # edges that exist (not deleted)
+        self.active: int = 0  # edges that are part of the path
+        self.visited: int = 0  # points touched by active edges
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['table']  # shared per grid size, no need to pickle it with every grid
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.table = edge_table(self.width, self.height)
+
+    @property
+    def edges(self) -> BitEdges:
+        return BitEdges(self)
+
+    def valid_moves(self, pt: Point) -> list[Point]:
+        results = []
+        for hop, bit, hop_bit in self.table.moves[pt]:
+            if self.present & bit and not self.active & bit and not self.visited & hop_bit:
+                results.append(hop)
+        return results
+
+    def add_link(self, start: Point, hop: Point) -> None:
+        pair: PointPair = frozenset((start, hop))
+        if pair not in self.edges:
+            raise Exception(f'Edge was expected to exist but did not: {pair}')
+        self.active |= self.table.edge_bit[pair]
+        self.visited |= self.table.point_bit[start] | self.table.point_bit[hop]
+        self.path.append(hop)
+
+    def append_to_path(self, hop: Point) -> None:
+        self.add_link(self.path[-1], hop)
+
+    def delete_edges_from_path(self, edges_to_del: set[PointPair]) -> None:
+        [self.edges.pop(e) for e in edges_to_del]
+
+    def touching_edges(self, x: int, y: int) -> int:
+        assert 0 <= x < self.width - 1
+        assert 0 <= y < self.height - 1
+        return (self.active & self.table.cell_edges[(x, y)]).bit_count()
+
+    def label_regions(self) -> list[list[int]]:
+        parent = list(range((self.width - 1) * (self.height - 1)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        active = self.active
+        for a, b, bit in self.table.cell_links:
+            if not active & bit:
+                parent[find(b)] = find(a)
+        return self._labels_from_roots([find(i) for i in range(len(parent))])
+
+    def _walk(self, cur_point: Point, complete_only: bool = False,
+              constraint: 'PathConstraint | None' = None) -> Iterator[tuple[PointPath, tuple[int, int]]]:
+        '''Same traversal as Grid._walk(), but yields the walked edges as an (edge mask, point mask) pair'''
+        moves = self.table.moves
+        present = self.present & ~self.active
+        visited = self.visited | self.table.point_bit[cur_point]
+        edges = 0
+        path = list(self.path)
+        end = self.end
+        frames = [(iter(moves[cur_point]), 0)]  # (move iterator, edge bit used to get here)
+        while frames:
+            for hop, bit, hop_bit in frames[-1][0]:
+                if visited & hop_bit or not present & bit:
+                    continue
+                if constraint is not None and not constraint.push(path[-1], hop):
+                    constraint.pop(path[-1], hop)
+                    continue
+                visited |= hop_bit
+                edges |= bit
+                path.append(hop)
+                if hop == end:
+                    if constraint is None or constraint.is_solved():
+                        yield path, (edges, visited)
+                    if complete_only:
+                        frames.append((iter(()), bit))
+                        break
+                elif not complete_only:
+                    yield path, (edges, visited)
+                frames.append((iter(moves[hop]), bit))
+                break
+            else:
+                _, bit = frames.pop()
+                if frames:
+                    if constraint is not None:
+                        constraint.pop(path[-2], path[-1])
+                    visited &= ~self.table.point_bit[path.pop()]
+                    edges &= ~bit
+
+    def copy_with_path(self, path: PointPath) -> 'BitGrid':
+        step_bit = self.table.step_bit
+        point_bit = self.table.point_bit
+        edges = 0
+        for step in itertools.pairwise(path):
+            edges |= step_bit[step]
+        visited = 0
+        for pt in path:
+            visited |= point_bit[pt]
+        return self.with_path(path, (edges, visited if len(path) > 1 else 0))
+
+    def with_path(self, path: PointPath, walked: tuple[int, int]) -> 'BitGrid':
+        edges, visited = walked
+        g = object.__new__(BitGrid)
+        g.__dict__.update(self.__dict__)
+        g.active = self.active | edges
+        g.visited = visited
+        g.path = list(path)
+        return g
+
+    def is_solved_region_puzzle(self, edges_to_del: set[PointPair]) -> bool:
+        # Cheap broken edge test first, then the region test from the base class
+        if self.active & self.table.edges_mask(edges_to_del):
+            return False
+        return super().is_solved_region_puzzle(set())
+
+
+GRID_BACKENDS = {
+    'frozenset': puzzle.Grid,
+    'bitboard': BitGrid,
+}
+
+
+def make_grid(width: int, height: int, start: Point | None = None, end: Point | None = None) -> puzzle.Grid:
+    '''Create a grid with the backend selected by cfg.GRID_BACKEND'''
+    return GRID_BACKENDS[cfg.GRID_BACKEND](width, height, start, end)
+
+
+def compare_backends():
+    '''Time the hot Grid operations with each backend, on the demo puzzles of puzzle.py'''
+    results = {}
+    for name, cls in GRID_BACKENDS.items():
+        timings = {}
+        grid = cls(5, 5)
+
+        s = time.perf_counter()
+        grids_with_paths = grid.find_all_paths(grid.start)
+        timings['find_all_paths'] = time.perf_counter() - s
+        grids_with_complete_paths = [g for g in grids_with_paths if g.path[-1] == g.end]
+
+        s = time.perf_counter()
+        tri_count = 0
+        for tri_cells in puzzle.DEMO_TRI_CELLS:
+            for g in grids_with_complete_paths:
+                g.set_cells(tri_cells)
+                tri_count += g.is_solved_tri_puzzle()
+        timings['is_solved_tri_puzzle'] = time.perf_counter() - s
+
+        s = time.perf_counter()
+        region_count = 0
+        for g in grids_with_complete_paths:
+            g.set_cells(puzzle.DEMO_REGION_CELLS)
+            region_count += g.is_solved_region_puzzle(puzzle.DEMO_REGION_EDGES_TO_DEL)
+        timings['is_solved_region_puzzle'] = time.perf_counter() - s
+
+        results[name] = timings
+        print(f'{name}: {len(grids_with_paths)} paths, {len(grids_with_complete_paths)} complete, '
+              f'{tri_count} tri answers, {region_count} region answers')
+
+    base = results['frozenset']
+    print(f'{"operation":<26}' + ''.join(f'{name:>12}' for name in results) + f'{"speedup":>10}')
+    for op in base:
+        row = f'{op:<26}' + ''.join(f'{timings[op]:>11.3f}s' for timings in results.values())
+        print(row + f'{base[op] / results["bitboard"][op]:>9.1f}x')
+
+
+if __name__ == '__main__':
+    compare_backends()
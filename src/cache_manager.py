@@ -0,0 +1,214 @@
+# Keeps the path caches (and their indexes) of several grid shapes, building them on demand and holding the most
+# recently used ones in memory under a byte budget.
+#
+# The paths of a cache are loaded first. Its triangle index and region labels are loaded (or built) by a background
+# thread after that, so a solve only waits for the index it uses. warm_up() loads a whole cache in the background,
+# so the runner can already wait for input while it does.
+#
+# The budget covers the memory the caches decode into (the triangle bitsets and region labels). The path records are
+# memory mapped from the cache file, so the OS can drop their pages at any time. They are reported apart from the
+# budget.
+import argparse
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+import cfg
+import bitgrid
+import path_cache
+import tri_index
+import region_index
+from typ import Point
+
+CacheKey = tuple[int, int, Point, Point]  # width, height, start, end
+
+
+@dataclass
+class PathCache:
+    '''Everything that is cached for one grid shape'''
+    key: CacheKey
+    grid: object  # puzzle.Grid with no path, cells or deleted edges
+    grids_with_paths: path_cache.PathStore
+    grids_with_complete_paths: path_cache.PathStore
+    mapped_bytes: int  # size of the memory mapped cache file
+    tri_future: Future  # of a tri_index.TriangleIndex
+    region_future: Future  # of a region_index.RegionIndex
+
+    @property
+    def tri_idx(self) -> tri_index.TriangleIndex:
+        return self.tri_future.result()  # waits if it is still being loaded
+
+    @property
+    def region_idx(self) -> region_index.RegionIndex:
+        return self.region_future.result()
+
+    @property
+    def nbytes(self) -> int:
+        '''Bytes of the loaded indexes. The mapped cache file is not counted.'''
+        nbytes = 0
+        if self.tri_future.done() and not self.tri_future.exception():
+            nbytes += sum((bits.bit_length() + 7) // 8 for bits in self.tri_idx.bitsets.values())
+        if self.region_future.done() and not self.region_future.exception():
+            nbytes += self.region_idx.labels.nbytes
+        return nbytes
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    build_times: dict[CacheKey, float] = field(default_factory=dict)  # seconds to build or load each entry
+
+
+class CacheManager:
+    '''Path caches keyed by (width, height, start, end), with least recently used eviction'''
+    def __init__(self, cache_dir: str = '.', max_bytes: int | None = None, workers: int | None = None):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = cfg.CACHE_BUDGET_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self.workers = cfg.PATH_WORKERS if workers is None else workers  # processes used to build missing caches
+        self.entries: OrderedDict[CacheKey, PathCache] = OrderedDict()
+        self.stats = CacheStats()
+        self.lock = threading.Lock()  # guards `entries`, `loading` and `stats`
+        self.loading: dict[CacheKey, Future] = {}  # entries being loaded by some thread
+        self.index_loader = ThreadPoolExecutor(1, thread_name_prefix='cache-index')
+
+    @staticmethod
+    def make_key(width: int, height: int, start: Point | None = None, end: Point | None = None) -> CacheKey:
+        # same defaults as puzzle.Grid
+        start = (0, height - 1) if start is None else start
+        end = (width - 1, 0) if end is None else end
+        return width, height, start, end
+
+    def cache_file(self, key: CacheKey) -> str:
+        width, height, start, end = key
+        if (start, end) == ((0, height - 1), (width - 1, 0)):
+            name = f'grid_{width}x{height}.paths.bin'  # default corners
+        else:
+            name = f'grid_{width}x{height}_{start[0]}-{start[1]}_{end[0]}-{end[1]}.paths.bin'
+        return str(self.cache_dir / name)
+
+    def get(self, width: int, height: int, start: Point | None = None, end: Point | None = None) -> PathCache:
+        '''Return the cache for the given grid shape, loading or building it if it is not in memory'''
+        key = self.make_key(width, height, start, end)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.stats.hits += 1
+                self.entries.move_to_end(key)
+                return entry
+            loading = self.loading.get(key)
+            if loading is None:
+                self.stats.misses += 1
+                loading = self.loading[key] = Future()
+                is_loader = True
+            else:
+                self.stats.hits += 1  # another thread is loading it already
+                is_loader = False
+        if not is_loader:
+            return loading.result()
+
+        try:
+            s = time.perf_counter()
+            entry = self._load(key)
+        except Exception as exc:
+            with self.lock:
+                del self.loading[key]
+            loading.set_exception(exc)
+            raise
+        with self.lock:
+            self.stats.build_times[key] = time.perf_counter() - s
+            self.entries[key] = entry
+            del self.loading[key]
+            self._evict()
+        loading.set_result(entry)
+        return entry
+
+    def warm_up(self, width: int, height: int, start: Point | None = None, end: Point | None = None) -> Future:
+        '''Load the cache for the given grid shape and its indexes in a background thread. Returns a future of the
+        PathCache that is done once everything is loaded.'''
+        done = Future()
+
+        def load():
+            try:
+                entry = self.get(width, height, start, end)
+                entry.tri_idx, entry.region_idx  # wait for the indexes too
+                done.set_result(entry)
+            except Exception as exc:
+                done.set_exception(exc)
+
+        threading.Thread(target=load, name='cache-warm-up', daemon=True).start()
+        return done
+
+    def available(self, width: int, height: int, start: Point | None = None, end: Point | None = None) -> bool:
+        '''Return True if the cache for the given grid shape is in memory or on disk (so get() does not build it)'''
+        key = self.make_key(width, height, start, end)
+        return key in self.entries or Path(self.cache_file(key)).exists()
+
+    def _load(self, key: CacheKey) -> PathCache:
+        width, height, start, end = key
+        cache_file = self.cache_file(key)
+        grid = bitgrid.make_grid(width, height, start, end)
+        if not Path(cache_file).exists():
+            grid.calc_paths(cache_file, self.workers)  # build and write it. Read it back below to only hold the compact records.
+        grids_with_paths, grids_with_complete_paths = grid.calc_paths(cache_file)
+        tri_future = self.index_loader.submit(tri_index.load_or_build, cache_file, grid, grids_with_complete_paths)
+        region_future = self.index_loader.submit(region_index.load_or_build, cache_file, grid, grids_with_complete_paths)
+        for future in (tri_future, region_future):
+            future.add_done_callback(self._index_loaded)
+        return PathCache(key, grid, grids_with_paths, grids_with_complete_paths, Path(cache_file).stat().st_size,
+                         tri_future, region_future)
+
+    def _index_loaded(self, _: Future) -> None:
+        # the entry just grew by an index, check the budget again
+        with self.lock:
+            self._evict()
+
+    def _evict(self) -> None:
+        '''Drop least recently used entries until the budget is met. The most recent entry is always kept.'''
+        while len(self.entries) > 1 and self.resident_bytes() > self.max_bytes:
+            key, _ = self.entries.popitem(last=False)
+            self.stats.evictions += 1
+            print(f'Evicted path cache for {key} from memory')
+
+    def resident_bytes(self) -> int:
+        return sum(entry.nbytes for entry in list(self.entries.values()))
+
+    def mapped_bytes(self) -> int:
+        return sum(entry.mapped_bytes for entry in list(self.entries.values()))
+
+    def report(self) -> str:
+        lookups = self.stats.hits + self.stats.misses
+        hit_rate = self.stats.hits / lookups if lookups else 0.0
+        lines = [f'Path caches: {len(self.entries)} resident, {self.resident_bytes() / 1024:.0f} KB of '
+                 f'{self.max_bytes / 1024:.0f} KB (+{self.mapped_bytes() / 1024:.0f} KB mapped), {self.stats.hits} hits, {self.stats.misses} misses '
+                 f'({hit_rate:.0%} hit rate), {self.stats.evictions} evictions']
+        for key, dur in self.stats.build_times.items():
+            resident = 'resident' if key in self.entries else 'evicted'
+            lines.append(f'  {key}: built/loaded in {dur:.3f}s, {resident}')
+        return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the path caches (and their indexes) of the given grid sizes '
+                                                 'ahead of time, so the solver does not have to.')
+    parser.add_argument('sizes', nargs='+', help='grid sizes in points, as WIDTHxHEIGHT. Ex: 5x5 6x6')
+    parser.add_argument('--cache-dir', default='.', help='directory the cache files are written to')
+    parser.add_argument('--workers', type=int, default=cfg.PATH_WORKERS,
+                        help='processes used to enumerate the paths. 0 = serial.')
+    args = parser.parse_args()
+
+    Path(args.cache_dir).mkdir(parents=True, exist_ok=True)
+    caches = CacheManager(args.cache_dir, workers=args.workers)
+    for size in args.sizes:
+        width, height = (int(v) for v in size.lower().split('x'))
+        entry = caches.get(width, height)
+        entry.tri_idx, entry.region_idx  # wait for the indexes to be written
+        caches.entries.clear()  # only building, nothing needs to stay resident
+    print(caches.report())
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,13 @@ from typ import Point
 DEBUG = False  # Must be True for tests to pass
 SHOW_DEBUG_IMG = False
 
+GRID_BACKEND = 'frozenset'  # 'frozenset' or 'bitboard'. See bitgrid.GRID_BACKENDS
+CACHE_BUDGET_MB = 512  # memory the indexes of the path caches of all grid sizes may hold. See cache_manager.py
+PATH_WORKERS = 0  # processes used to enumerate paths when a path cache is built. 0 = serial. See parallel_paths.py
+SOLUTION_MEMO_FILE = 'solutions.memo'  # answers of solved panels, kept across sessions. See solution_cache.py
+FILTER_WORKERS = 0  # processes that check cached paths against a puzzle. 0 = use the indexes instead. See parallel_filter.py
+TRACE = True  # time the steps of each solve as nested spans. See spans.py
+
 if DEBUG:
     # good for debugging by showing all edges and intersections
     # EMPTY, START, END, INTERSECT, HORIZ_ON, HORIZ_OFF, VERT_ON, VERT_OFF = ' O^+X-X|'
@@ -66,12 +73,15 @@ TRIANGLE_ICON_RGB = (250, 187, 10)
 # TRIANGLE_BROWN_RGB = (34, 17, 2)  # color of the surrounding wall
 
 class PuzzleConfig:
+    # Each puzzle type sets GRID_SIZE, the width and height of its panel's grid in grid line intersections (like
+    # puzzle.Grid). The size is not detected from the screenshot.
     PANEL_BOUNDING_BOX_WHISKER_START_X = (SCREEN_WIDTH*.41, SCREEN_WIDTH*.59)
     PANEL_BOUNDING_BOX_WHISKER_START_Y = (SCREEN_HEIGHT*.375, SCREEN_HEIGHT*.625)
 
 
 class Region2ColorStarter(PuzzleConfig):
     '''Handles the initial starter 2-color region puzzle'''
+    GRID_SIZE = (5, 5)
     palette = (
         BLACK_RGB +
         CELL_BLACK_RGB +
@@ -104,6 +114,7 @@ class Region2ColorStarter(PuzzleConfig):
 
 class RegionColorTriplet(PuzzleConfig):
     '''Handles the 2 color or 3 color region puzzles'''
+    GRID_SIZE = (5, 5)
     palette = (
         BLACK_RGB +
         CELL_BLACK_RGB +
@@ -142,6 +153,7 @@ class RegionColorTriplet(PuzzleConfig):
 
 class Triangle(PuzzleConfig):
     '''Handles the triangle puzzle'''
+    GRID_SIZE = (5, 5)
     palette = (
         # BLACK_RGB +
         CELL_WHITE_RGB +
@@ -161,3 +173,8 @@ class Triangle(PuzzleConfig):
 
     def line_pattern(self):
         return [self.TRIANGLE_BACKGROUND, self.TRIANGLE_LINE, self.TRIANGLE_LINE, self.TRIANGLE_LINE]
+
+
+def grid_sizes() -> list[tuple[int, int]]:
+    '''The distinct grid sizes of all puzzle types'''
+    return sorted({config.GRID_SIZE for config in (Region2ColorStarter, RegionColorTriplet, Triangle)})
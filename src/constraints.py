@@ -0,0 +1,188 @@
+# Puzzle rules that are checked incrementally while a path is being searched, so dead branches can be cut early.
+# See Grid.iter_paths()
+import cfg
+from typ import Point, PointPair
+
+
+class PathConstraint:
+    '''Base class for constraints that follow a path as it is searched.
+
+    The search calls push() for every edge it adds to the path. If push() returns False, the branch is cut. pop() is
+    called for every push() (including rejected ones) when the search backs out of that edge again. is_solved() is
+    called once the path reaches the end point.'''
+    def push(self, a: Point, b: Point) -> bool:
+        return True
+
+    def pop(self, a: Point, b: Point) -> None:
+        pass
+
+    def is_solved(self) -> bool:
+        return True
+
+
+class TriangleConstraint(PathConstraint):
+    '''Tracks how many path edges touch each numbered cell of a Triangle puzzle.
+
+    A branch is cut when a cell has more touching edges than its count, or when the edges that are still free around
+    a cell can not bring it up to its count. An edge is free if it exists, is not on the path, and both ends are either
+    unvisited or the head of the path.'''
+    def __init__(self, grid):
+        self.required: dict[Point, int] = {}
+        for y in range(grid.height - 1):
+            for x in range(grid.width - 1):
+                cell = grid.cells[y][x]
+                if cell != ' ':
+                    self.required[(x, y)] = int(cell)
+
+        # numbered cells on each side of an edge, and numbered cells that have a point as one of their corners
+        self.edge_cells: dict[PointPair, list[Point]] = {}
+        self.point_cells: dict[Point, list[Point]] = {}
+        self.cell_edges: dict[Point, list[PointPair]] = {}
+        for cell in self.required:
+            edges = [grid.calc_edge(cell, d) for d in (cfg.RIGHT, cfg.UP, cfg.LEFT, cfg.DOWN)]
+            self.cell_edges[cell] = edges
+            for edge in edges:
+                self.edge_cells.setdefault(edge, []).append(cell)
+                for pt in edge:
+                    cells = self.point_cells.setdefault(pt, [])
+                    if cell not in cells:
+                        cells.append(cell)
+
+        self.open_edges = {pair for pair, state in grid.edges.items() if state == False}
+        self.touching = dict.fromkeys(self.required, 0)
+        self.visited = set(grid.path)
+        self.head = grid.path[-1]
+        for pair, state in grid.edges.items():
+            if state == True:
+                for cell in self.edge_cells.get(pair, ()):
+                    self.touching[cell] += 1
+
+    def _is_free(self, edge: PointPair) -> bool:
+        if edge not in self.open_edges:
+            return False
+        a, b = edge
+        return (a == self.head or a not in self.visited) and (b == self.head or b not in self.visited)
+
+    def _can_reach_count(self, cell: Point) -> bool:
+        missing = self.required[cell] - self.touching[cell]
+        if missing <= 0:
+            return True
+        free = [e for e in self.cell_edges[cell] if self._is_free(e)]
+        return len(free) >= missing
+
+    def push(self, a: Point, b: Point) -> bool:
+        ok = True
+        for cell in self.edge_cells.get(frozenset((a, b)), ()):
+            self.touching[cell] += 1
+            if self.touching[cell] > self.required[cell]:
+                ok = False
+        self.visited.add(b)
+        self.head = b
+        if not ok:
+            return False
+
+        # Only the cells around the old and new head can have lost free edges
+        for cell in self.point_cells.get(a, ()):
+            if not self._can_reach_count(cell):
+                return False
+        for cell in self.point_cells.get(b, ()):
+            if not self._can_reach_count(cell):
+                return False
+        return True
+
+    def pop(self, a: Point, b: Point) -> None:
+        for cell in self.edge_cells.get(frozenset((a, b)), ()):
+            self.touching[cell] -= 1
+        self.visited.remove(b)
+        self.head = a
+
+    def is_solved(self) -> bool:
+        return self.touching == self.required
+
+
+class RegionConstraint(PathConstraint):
+    '''Colour separation check for region puzzles (Region2ColorStarter, RegionColorTriplet) that runs as the path grows.
+
+    A region can only be closed off while the path touches the outer border. When the path leaves a border point, each
+    region around that point that is no longer touching the head of the path is sealed: the rest of the path can not
+    get into it anymore. If a sealed region holds more than one colour, the branch is cut.
+    Only path edges separate regions here. Missing (broken) edges do not.'''
+    def __init__(self, grid):
+        self.width = grid.width
+        self.height = grid.height
+        self.colors: dict[Point, str] = {}
+        self.neighbours: dict[Point, list[tuple[Point, PointPair]]] = {}
+        for y in range(grid.height - 1):
+            for x in range(grid.width - 1):
+                cell = (x, y)
+                if grid.cells[y][x].strip() != '':
+                    self.colors[cell] = grid.cells[y][x]
+                neighbours = []
+                for d in (cfg.RIGHT, cfg.UP, cfg.LEFT, cfg.DOWN):
+                    n = x + d[0], y + d[1]
+                    if 0 <= n[0] < grid.width - 1 and 0 <= n[1] < grid.height - 1:
+                        neighbours.append((n, grid.calc_edge(cell, d)))
+                self.neighbours[cell] = neighbours
+
+        self.walls = {pair for pair, state in grid.edges.items() if state == True}
+
+    def _is_border(self, pt: Point) -> bool:
+        x, y = pt
+        return x == 0 or y == 0 or x == self.width - 1 or y == self.height - 1
+
+    def _point_cells(self, pt: Point) -> list[Point]:
+        '''Cells that have the given point as a corner'''
+        x, y = pt
+        cells = ((x - 1, y - 1), (x, y - 1), (x - 1, y), (x, y))
+        return [c for c in cells if 0 <= c[0] < self.width - 1 and 0 <= c[1] < self.height - 1]
+
+    def _flood(self, start: Point, stop_at: set[Point]) -> tuple[set[Point], bool]:
+        '''Grow the region that contains `start`. Returns the cells found and whether a cell in `stop_at` was reached
+        (growth stops early when it is).'''
+        region = {start}
+        todo = [start]
+        while todo:
+            cell = todo.pop()
+            if cell in stop_at:
+                return region, True
+            for n, edge in self.neighbours[cell]:
+                if n not in region and edge not in self.walls:
+                    region.add(n)
+                    todo.append(n)
+        return region, False
+
+    def _is_mixed(self, region: set[Point]) -> bool:
+        colors = {self.colors[c] for c in region if c in self.colors}
+        return len(colors) > 1
+
+    def push(self, a: Point, b: Point) -> bool:
+        self.walls.add(frozenset((a, b)))
+        if not self._is_border(a):
+            return True
+
+        # regions around `a` that the head at `b` does not touch are sealed
+        open_cells = set(self._point_cells(b))
+        seen: set[Point] = set()
+        for cell in self._point_cells(a):
+            if cell in seen:
+                continue
+            region, is_open = self._flood(cell, open_cells)
+            seen.update(region)
+            if not is_open and self._is_mixed(region):
+                return False
+        return True
+
+    def pop(self, a: Point, b: Point) -> None:
+        self.walls.remove(frozenset((a, b)))
+
+    def is_solved(self) -> bool:
+        # every region is sealed once the path is complete
+        seen: set[Point] = set()
+        for cell in self.neighbours:
+            if cell in seen:
+                continue
+            region, _ = self._flood(cell, set())
+            seen.update(region)
+            if self._is_mixed(region):
+                return False
+        return True
@@ -1,6 +1,7 @@
 # Utilities to read an image and pull details from it (cell colors, broken links, etc)
 import itertools
 
+import numpy as np
 from PIL import Image, ImageDraw
 import cfg
 from typ import PointPair, CellGrid
@@ -8,65 +9,101 @@ import utils
 import plot_utils
 import img_proc
 import puzzle
+from spans import traced
 
 
-def get_puzzle_details(img: Image) -> tuple[CellGrid, set[PointPair]]:
+def get_puzzle_details(img: Image, bounding_box: img_proc.Rect | None = None) -> tuple[CellGrid, set[PointPair]]:
+    '''Parse the cells and broken edges of the panel. The panel is found with find_bounding_box() unless its
+    `bounding_box` is given (ex: by runner.preprocess_panel()).'''
     print('Parsing details from puzzle')
-    bounding_box = find_bounding_box(img)
+    if bounding_box is None:
+        bounding_box = find_bounding_box(img)
     puzzle_img = img.crop(bounding_box.as_tuple())
     plot_utils.show(puzzle_img)
+    width, height = cfg.Puzzle.GRID_SIZE
     if isinstance(cfg.Puzzle, cfg.Triangle):
-        cells = find_triangle_counts(puzzle_img)
+        cells = find_triangle_counts(puzzle_img, width, height)
         broken_links = set()
     else:
-        cells = find_cell_colors(puzzle_img)
+        cells = find_cell_colors(puzzle_img, width, height)
         if isinstance(cfg.Puzzle, cfg.Region2ColorStarter):
-            broken_links = find_broken_edges(puzzle_img)
+            broken_links = find_broken_edges(puzzle_img, width, height)
         else:
             broken_links = set()
     return cells, broken_links
 
 
-def find_bounding_box(img: Image) -> img_proc.Rect:
+def find_pattern(line: np.ndarray, pattern: list[int]) -> np.ndarray:
+    '''Indices where `pattern` starts in `line` (1D array of palette indexes), in increasing order'''
+    count = len(line) - len(pattern) + 1
+    if count <= 0:
+        return np.empty(0, dtype=np.intp)
+    hits = line[:count] == pattern[0]
+    for offset, value in enumerate(pattern[1:], 1):
+        hits &= line[offset:offset + count] == value
+    return np.flatnonzero(hits)
+
+
+def draw_crosses(img: Image, crosses: list[tuple[float, float]]) -> None:
+    drw = ImageDraw.Draw(img)
+    for x, y in crosses:
+        img_proc.cross(drw, x, y, cfg.Puzzle.DEBUG_COLOR)
+
+
+@traced()
+def find_bounding_box(img: Image, crosses: list[tuple[float, float]] | None = None) -> img_proc.Rect:
+    '''Find the border of the panel in a palettised screenshot, where each whisker (a full row or column of the screen)
+    first and last crosses the border's line pattern. Only the whiskers are read. A debug cross is drawn on `img` at
+    every hit, and also appended to `crosses` if it is given.'''
     print('Identifying bounding box of puzzle image')
     top_points = []
     bottom_points = []
     left_points = []
     right_points = []
+    pattern = cfg.Puzzle.line_pattern()
+    backwards = list(reversed(pattern))
+    crosses = [] if crosses is None else crosses
 
     drw = ImageDraw.Draw(img)
 
+    def mark(x, y):
+        img_proc.cross(drw, x, y, cfg.Puzzle.DEBUG_COLOR)
+        crosses.append((x, y))
+
+    # Each whisker is read right before it is searched, after the crosses of the whiskers before it are drawn (they can
+    # overlap it)
     for x in cfg.Puzzle.PANEL_BOUNDING_BOX_WHISKER_START_X:
-        pixels = [img.getpixel((x, y)) for y in range(0, cfg.SCREEN_HEIGHT)]
+        pixels = np.asarray(img.crop((int(x), 0, int(x) + 1, cfg.SCREEN_HEIGHT))).ravel()
         # Search from the top pointing down
-        for y in range(len(pixels)):
-            if pixels[y:y+4] == cfg.Puzzle.line_pattern():
-                img_proc.cross(drw, x, y, cfg.Puzzle.DEBUG_COLOR)
-                top_points.append((x, y))
-                break
+        found = find_pattern(pixels, pattern)
+        if len(found):
+            y = int(found[0])
+            mark(x, y)
+            top_points.append((x, y))
 
         # Search from the bottom pointing up
-        for y in range(len(pixels), -1, -1):
-            if pixels[y:y+4] == list(reversed(cfg.Puzzle.line_pattern())):
-                img_proc.cross(drw, x, y+3, cfg.Puzzle.DEBUG_COLOR)
-                bottom_points.append((x, y+3))
-                break
+        found = find_pattern(pixels, backwards)
+        if len(found):
+            y = int(found[-1])
+            mark(x, y+3)
+            bottom_points.append((x, y+3))
 
     for y in cfg.Puzzle.PANEL_BOUNDING_BOX_WHISKER_START_Y:
-        pixels = [img.getpixel((x, y)) for x in range(0, cfg.SCREEN_WIDTH)]
+        pixels = np.asarray(img.crop((0, int(y), cfg.SCREEN_WIDTH, int(y) + 1))).ravel()
         # Search from the left pointing right
-        for x in range(int(cfg.SCREEN_WIDTH*0.23), len(pixels)):  # 23% is to skip the puzzle to the left for the 1st puzzle
-            if pixels[x:x+4] == cfg.Puzzle.line_pattern():
-                img_proc.cross(drw, x, y, cfg.Puzzle.DEBUG_COLOR)
-                left_points.append((x, y))
-                break
+        skip = int(cfg.SCREEN_WIDTH*0.23)  # 23% is to skip the puzzle to the left for the 1st puzzle
+        found = find_pattern(pixels[skip:], pattern)
+        if len(found):
+            x = skip + int(found[0])
+            mark(x, y)
+            left_points.append((x, y))
 
         # Search from the right pointing left
-        for x in range(len(pixels), -1, -1):
-            if pixels[x:x+4] == list(reversed(cfg.Puzzle.line_pattern())):
-                img_proc.cross(drw, x+3, y, cfg.Puzzle.DEBUG_COLOR)
-                right_points.append((x+3, y))
-                break
+        found = find_pattern(pixels, backwards)
+        if len(found):
+            x = int(found[-1])
+            mark(x+3, y)
+            right_points.append((x+3, y))
 
     left = int(sum([x for x, y in left_points]) / len(left_points))
     right = int(sum([x for x, y in right_points]) / len(right_points))
@@ -83,17 +120,19 @@ def find_bounding_box(img: Image) -> img_proc.Rect:
     return r
 
 
-def find_cell_colors(img: Image) -> CellGrid:
+@traced()
+def find_cell_colors(img: Image, width: int = 5, height: int = 5) -> CellGrid:
+    '''`width` and `height` are the size of the grid (in grid line intersections, like Grid), not the number of cells'''
     print('Parsing cell colors from puzzle image')
     print(img)
     drw = ImageDraw.Draw(img)
-    h_slice = img.width / 8
-    v_slice = img.height / 8
+    h_slice = img.width / ((width - 1) * 2)
+    v_slice = img.height / ((height - 1) * 2)
 
     cells = []
-    for y_chunk in (1, 3, 5, 7):
+    for y_chunk in range(1, (height - 1) * 2, 2):
         row = []
-        for x_chunk in (1, 3, 5, 7):
+        for x_chunk in range(1, (width - 1) * 2, 2):
             x = x_chunk * h_slice
             y = y_chunk * v_slice
             p = img.getpixel((x, y))
@@ -107,17 +146,18 @@ def find_cell_colors(img: Image) -> CellGrid:
     return tuple(cells)
 
 
-def find_triangle_counts(img: Image) -> CellGrid:
+@traced()
+def find_triangle_counts(img: Image, width: int = 5, height: int = 5) -> CellGrid:
     print('Counting number of triangles')
     drw = ImageDraw.Draw(img)
 
     cells = []
     full_rect = img_proc.Rect.from_img(img)
-    for cell_y in range(4):
+    for cell_y in range(height - 1):
         row = []
-        for cell_x in range(4):
+        for cell_x in range(width - 1):
             # subdivide grid into per-cell region
-            sub_rect = full_rect.divide(4, cell_x, cell_y)
+            sub_rect = full_rect.divide((width - 1, height - 1), cell_x, cell_y)
 
             # determine the y of the triangles (50%)
             triangle_y = utils.lerp(sub_rect.y1, sub_rect.y2, 0.5)
@@ -139,16 +179,17 @@ def find_triangle_counts(img: Image) -> CellGrid:
     return tuple(cells)
 
 
-def find_broken_edges(img: Image) -> set[PointPair]:
+@traced()
+def find_broken_edges(img: Image, width: int = 5, height: int = 5) -> set[PointPair]:
     print('Parsing broken edges from puzzle image')
 
     edges_to_del = set()
     drw = ImageDraw.Draw(img)
-    h_step = img.width / 4
-    v_step = img.height / 4
+    h_step = img.width / (width - 1)
+    v_step = img.height / (height - 1)
     print(img)
 
-    for edge in puzzle.Grid.enumerate_all_edges(5, 5):
+    for edge in puzzle.Grid.enumerate_all_edges(width, height):
         p1, p2 = edge
         mid_point_idx = utils.pt_lerp(p1, p2, 0.5)
         x, y = mid_point_idx[0] * h_step, mid_point_idx[1] * v_step
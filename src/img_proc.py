@@ -1,9 +1,7 @@
 # Basic utils for interacting with an image
 import datetime
-import ctypes
 from typing import Self
-from ctypes import wintypes
-from PIL import Image, ImageGrab, ImageColor
+from PIL import Image, ImageColor
 import cfg
 import utils
 
@@ -17,6 +15,7 @@ CLR = Clr()
 
 
 def get_screenshot(bounding_box=None, idx=0, save=False):
+    from PIL import ImageGrab  # only needed when capturing the game window
     im = ImageGrab.grab(bounding_box.as_tuple())
     if save:
         im.save(f'shot{idx:04d}.jpg')
@@ -51,18 +50,23 @@ class Rect:
             self.x2+delta,
             self.y2+delta)
 
-    def divide(self, divs: int, cell_x: int, cell_y: int) -> Self:
-        fraction = 1/divs
+    def divide(self, divs: int | tuple[int, int], cell_x: int, cell_y: int) -> Self:
+        '''`divs` is the number of divisions on both axes, or a (horizontal, vertical) pair'''
+        x_divs, y_divs = divs if isinstance(divs, tuple) else (divs, divs)
+        x_fraction = 1/x_divs
+        y_fraction = 1/y_divs
         r = Rect(
-            utils.lerp(self.x1, self.x2, cell_x * fraction),
-            utils.lerp(self.y1, self.y2, cell_y * fraction),
-            utils.lerp(self.x1, self.x2, (cell_x + 1) * fraction),
-            utils.lerp(self.y1, self.y2, (cell_y + 1) * fraction),
+            utils.lerp(self.x1, self.x2, cell_x * x_fraction),
+            utils.lerp(self.y1, self.y2, cell_y * y_fraction),
+            utils.lerp(self.x1, self.x2, (cell_x + 1) * x_fraction),
+            utils.lerp(self.y1, self.y2, (cell_y + 1) * y_fraction),
         )
         return r
 
 
 def get_win_location(desc) -> Rect :
+    import ctypes  # Windows only, and only needed when capturing the game window
+    from ctypes import wintypes
     user32 = ctypes.windll.user32
     handle = user32.FindWindowW(None, desc)
     rect = wintypes.RECT()
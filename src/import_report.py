@@ -0,0 +1,68 @@
+'''
+Report how long the entry points take to import, using `python -X importtime` in a fresh interpreter each run.
+Tracks the startup cost of the tools and flags heavy optional dependencies that got imported when they should load
+lazily (plotting, hotkeys, window capture).
+
+    python import_report.py                  # runner, runner_all and puzzle
+    python import_report.py runner --top 20
+'''
+import argparse
+import statistics
+import subprocess
+import sys
+from dataclasses import dataclass
+
+ENTRY_POINTS = ('runner', 'runner_all', 'puzzle')
+LAZY_MODULES = ('matplotlib', 'keyboard', 'ctypes.wintypes', 'PIL.ImageGrab')  # only imported when used
+
+
+@dataclass
+class ImportTime:
+    name: str
+    self_us: int
+    cumulative_us: int
+    depth: int  # 0 for modules imported directly by the entry point's import
+
+
+def measure(module: str) -> list[ImportTime]:
+    '''Import `module` in a fresh interpreter and return the -X importtime records, in import order'''
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          capture_output=True, text=True, check=True)
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append(ImportTime(name.strip(), int(self_us), int(cumulative_us), depth))
+    return times
+
+
+def report(module: str, runs: int = 3, top: int = 10) -> str:
+    '''Median total import time of `module` over `runs` runs, its slowest imports and any lazy module that got loaded'''
+    all_runs = [measure(module) for _ in range(runs)]
+    totals = [next(t.cumulative_us for t in times if t.name == module) for times in all_runs]
+    times = all_runs[totals.index(sorted(totals)[len(totals) // 2])]  # the median run
+
+    lines = [f'{module}: {statistics.median(totals) / 1000:.1f} ms median over {runs} runs '
+             f'(min {min(totals) / 1000:.1f} ms, max {max(totals) / 1000:.1f} ms)']
+    for t in sorted(times, key=lambda t: t.cumulative_us, reverse=True)[1:top + 1]:
+        lines.append(f'  {t.cumulative_us / 1000:>8.1f} ms cumulative {t.self_us / 1000:>7.1f} ms self  '
+                     f'{"  " * t.depth}{t.name}')
+    loaded = [name for name in LAZY_MODULES if any(t.name == name for t in times)]
+    lines.append(f'  lazy modules imported at startup: {", ".join(loaded) if loaded else "none"}')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time of the entry points')
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS, help='modules to import')
+    parser.add_argument('--runs', type=int, default=3, help='fresh interpreters per module, the median is reported')
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list per module')
+    args = parser.parse_args()
+    for module in args.modules:
+        print(report(module, args.runs, args.top))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# Bidirectional (meet in the middle) enumeration of the complete paths of a grid.
+#
+# A complete path with L edges is split at its middle point: a forward half of ceil(L / 2) edges grown from the start,
+# and a backward half of floor(L / 2) edges grown from the end. Both sets of halves are only about as deep as half the
+# longest path, so they are far smaller than the full search tree. The halves are joined on (middle point, length),
+# and a pair forms a path when the halves share no point but the middle one.
+#
+# Halves are kept as (point mask, edge mask) pairs (see bitgrid.EdgeTable). Each forward half is checked against all
+# backward halves of its bucket in one NumPy AND over their point masks. The points of a joined path are rebuilt from
+# its edge mask with path_cache.decode_path().
+#
+# A HalfKey narrows the join further. TriangleCounts keys the halves by how many of their edges touch each numbered
+# cell, so a forward half is only tried against the backward halves that bring every cell to exactly its count.
+import time
+from typing import Callable, Iterator
+import numpy as np
+import bitgrid
+import path_cache
+import puzzle
+from typ import Point
+
+Half = tuple[int, int]  # (point mask, edge mask)
+
+
+class HalfKey:
+    '''No narrowing: every half is viable and all halves share the same key'''
+    def viable(self, edges: int, open_edges: int) -> bool:
+        '''Return False if no path that contains the half with `edges` can pass the constraint. `open_edges` are the
+        edges the other half could still use. Prunes the half searches.'''
+        return True
+
+    def key(self, edges: int) -> tuple:
+        return ()
+
+    def wanted(self, key: tuple) -> tuple:
+        '''Key the backward half must have to complete a forward half with the given key'''
+        return ()
+
+
+class TriangleCounts(HalfKey):
+    '''Keys halves by the number of their edges that touch each numbered cell of a Triangle puzzle'''
+    def __init__(self, grid):
+        table = bitgrid.edge_table(grid.width, grid.height)
+        self.cells: list[tuple[int, int]] = []  # (mask of the cell's edges, required count)
+        for y, row in enumerate(grid.cells):
+            for x, cell in enumerate(row):
+                if cell != ' ':
+                    self.cells.append((table.cell_edges[(x, y)], int(cell)))
+
+    def viable(self, edges: int, open_edges: int) -> bool:
+        for mask, count in self.cells:
+            touching = (edges & mask).bit_count()
+            if touching > count or touching + (open_edges & mask).bit_count() < count:
+                return False
+        return True
+
+    def key(self, edges: int) -> tuple:
+        return tuple((edges & mask).bit_count() for mask, _ in self.cells)
+
+    def wanted(self, key: tuple) -> tuple:
+        return tuple(count - k for (_, count), k in zip(self.cells, key))
+
+
+def free_edges(grid) -> int:
+    '''Mask of the edges that exist and are not on the grid's path'''
+    if isinstance(grid, bitgrid.BitGrid):
+        return grid.present & ~grid.active
+    table = bitgrid.edge_table(grid.width, grid.height)
+    return table.edges_mask(pair for pair, state in grid.edges.items() if state == False)
+
+
+def half_paths(grid, origin: Point, stop: Point, max_len: int, half_key: HalfKey) -> dict[tuple, list[Half]]:
+    '''Return every path of up to `max_len` edges grown from `origin`, grouped by (last point, length, key).
+    `stop` (the other end of the complete paths) can end a half but is never walked through.'''
+    table = bitgrid.edge_table(grid.width, grid.height)
+    moves = table.moves
+    free = free_edges(grid)
+    stop_bit = table.point_bit[stop]
+    key = half_key.key
+    viable = half_key.viable
+    point_edges = {pt: sum(bit for _, bit, _ in pt_moves) for pt, pt_moves in moves.items()}
+
+    halves: dict[tuple, list[Half]] = {}
+    visited = table.point_bit[origin]
+    halves[(origin, 0, key(0))] = [(visited, 0)]
+    edges = 0
+    path = [origin]
+    # (move iterator, edge bit used to get here, edges touching the points before the head). Points behind the head
+    # are closed to the other half, so their edges can no longer be used.
+    frames = [(iter(moves[origin]), 0, 0)]
+    while frames:
+        moves_iter, _, closed = frames[-1]
+        for hop, bit, hop_bit in moves_iter:
+            if visited & hop_bit or not free & bit:
+                continue
+            hop_closed = closed | point_edges[path[-1]]
+            if not viable(edges | bit, free & ~hop_closed):
+                continue
+            visited |= hop_bit
+            edges |= bit
+            path.append(hop)
+            halves.setdefault((hop, len(path) - 1, key(edges)), []).append((visited, edges))
+            if len(path) > max_len or hop_bit == stop_bit:
+                frames.append((iter(()), bit, hop_closed))  # dead end, pop it right away
+            else:
+                frames.append((iter(moves[hop]), bit, hop_closed))
+            break
+        else:
+            _, bit, _ = frames.pop()
+            if frames:
+                visited &= ~table.point_bit[path.pop()]
+                edges &= ~bit
+    return halves
+
+
+def iter_masks(grid, half_key: HalfKey | None = None) -> Iterator[tuple[int, int]]:
+    '''Yield the (edge mask, point mask) of every complete path from `grid.start` to `grid.end` that passes `half_key`. `grid` must
+    not have a path yet, its missing edges are avoided. Paths come out grouped by middle point, not in the order of
+    find_all_paths().'''
+    half_key = HalfKey() if half_key is None else half_key
+    table = bitgrid.edge_table(grid.width, grid.height)
+    longest = grid.width * grid.height - 1  # edges in a path through every point
+    forward = half_paths(grid, grid.start, grid.end, (longest + 1) // 2, half_key)
+    backward = half_paths(grid, grid.end, grid.start, longest // 2, half_key)
+
+    # Backward point masks as arrays, so each forward half is checked against a whole bucket in one vectorized AND.
+    # Past 64 points the masks do not fit a uint64 and stay Python ints in an object array.
+    if grid.width * grid.height <= 64:
+        dtype, scalar = np.uint64, np.uint64
+    else:
+        dtype, scalar = object, int
+    buckets = {bucket: (np.array([points for points, _ in halves], dtype=dtype), halves)
+               for bucket, halves in backward.items()}
+
+    for (middle, length, key), halves in forward.items():
+        middle_bit = scalar(table.point_bit[middle])
+        wanted = half_key.wanted(key)
+        for back_length in (length, length - 1):
+            matches = buckets.get((middle, back_length, wanted))
+            if matches is None:
+                continue
+            back_points, back_halves = matches
+            for points, edges in halves:
+                for idx in np.flatnonzero((back_points & scalar(points)) == middle_bit).tolist():
+                    other_points, other_edges = back_halves[idx]
+                    yield edges | other_edges, points | other_points
+
+
+def iter_paths(grid, half_key: HalfKey | None = None,
+               is_solved: Callable[[puzzle.Grid], bool] | None = None) -> Iterator[puzzle.Grid]:
+    '''Yield grids with the complete paths of iter_masks() that also pass `is_solved`
+    (ex: puzzle.Grid.is_solved_tri_puzzle)'''
+    table = bitgrid.edge_table(grid.width, grid.height)
+    is_bit_grid = isinstance(grid, bitgrid.BitGrid)
+    for edges, points in iter_masks(grid, half_key):
+        path = path_cache.decode_path(table, grid.start, edges)
+        g = grid.with_path(path, (edges, points)) if is_bit_grid else grid.copy_with_path(path)
+        if is_solved is None or is_solved(g):
+            yield g
+
+
+def compare_enumeration(sizes=(3, 4, 5, 6)):
+    '''Time enumerating all complete paths with find_all_paths() and with the meet in the middle join, per grid size.
+    find_all_paths() also builds every partial path, which is out of reach beyond 5x5. Larger grids are compared with
+    the depth-first search of complete paths only (Grid.iter_paths()) instead.'''
+    print(f'{"grid":<6}{"paths":>10}{"baseline":>16}{"meet_middle":>14}{"speedup":>10}')
+    for size in sizes:
+        grid = bitgrid.make_grid(size, size)
+
+        s = time.perf_counter()
+        if size <= 5:
+            baseline = 'find_all_paths'
+            expected = [g.path for g in grid.find_all_paths(grid.start) if g.path[-1] == grid.end]
+        else:
+            baseline = 'iter_paths'
+            expected = [g.path for g in grid.iter_paths()]
+        serial = time.perf_counter() - s
+
+        s = time.perf_counter()
+        paths = [g.path for g in iter_paths(grid)]
+        joined = time.perf_counter() - s
+
+        assert sorted(paths) == sorted(expected)
+        print(f'{size}x{size:<4}{len(paths):>10}{serial:>15.3f}s{joined:>13.3f}s{serial / joined:>9.1f}x  vs {baseline}')
+
+
+if __name__ == '__main__':
+    compare_enumeration()
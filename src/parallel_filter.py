@@ -0,0 +1,123 @@
+# Checks cached complete paths against a puzzle in several worker processes (see runner.find_solutions()).
+#
+# The records of a path cache (see path_cache.py) are copied once into a shared memory block. Workers attach to it
+# read-only by name and decode the paths of their chunk straight from it, so no worker unpickles its own copy of the
+# cache. The pool and the shared blocks are kept between solves, so only the first solve pays for starting them.
+#
+# When only the first answer is wanted, the lowest matching path id is returned, the same one the serial search and the
+# indexes give. Workers share the lowest match found so far and drop the rest of a chunk once they are past it.
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+import numpy as np
+import bitgrid
+import path_cache
+from typ import CellGrid, Point, PointPair
+
+CHUNK_SIZE = 2000  # paths per task. Small enough that a found answer cancels most of the work.
+CANCEL_CHECK = 200  # paths checked between looks at the lowest match so far
+NO_MATCH = np.iinfo(np.int64).max
+
+
+@dataclass(frozen=True)
+class SharedStore:
+    '''What a worker needs to rebuild a PathStore over a shared memory block'''
+    name: str
+    backend: str
+    width: int
+    height: int
+    start: Point
+    end: Point
+    count: int
+    record_size: int
+
+
+# Worker process state
+_best = None  # multiprocessing.Value of the lowest matching path id found so far, NO_MATCH if none
+_attached: dict[str, tuple[shared_memory.SharedMemory, path_cache.PathStore]] = {}
+
+
+def _init_worker(best) -> None:
+    global _best
+    _best = best
+
+
+def _attach(store: SharedStore) -> path_cache.PathStore:
+    if store.name not in _attached:
+        shm = shared_memory.SharedMemory(name=store.name)  # workers share the main process' resource tracker
+        grid = bitgrid.GRID_BACKENDS[store.backend](store.width, store.height, store.start, store.end)
+        _attached[store.name] = shm, path_cache.PathStore(shm.buf, 0, store.count, store.record_size, grid)
+    return _attached[store.name][1]
+
+
+def _check_chunk(store: SharedStore, path_ids: np.ndarray, cells: CellGrid, broken_edges: set[PointPair],
+                 is_tri_puzzle: bool, first_only: bool) -> list[int]:
+    '''Worker: return the ids in `path_ids` (ascending) whose paths solve the puzzle. If `first_only`, stop at the
+    first one, or as soon as a lower match was found by another chunk.'''
+    paths = _attach(store)
+    found = []
+    for num, path_id in enumerate(path_ids.tolist()):
+        if first_only and num % CANCEL_CHECK == 0 and _best.value < path_id:
+            break
+        g = paths[path_id]
+        g.set_cells(cells)
+        if g.is_solved_tri_puzzle() if is_tri_puzzle else g.is_solved_region_puzzle(broken_edges):
+            found.append(path_id)
+            if first_only:
+                with _best.get_lock():
+                    _best.value = min(_best.value, path_id)
+                break
+    return found
+
+
+class FilterPool:
+    '''Warm pool of worker processes, plus the shared memory copies of the path caches they check'''
+    def __init__(self, workers: int | None = None):
+        self.best = multiprocessing.Value('q', NO_MATCH)
+        self.pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(self.best,))
+        self.blocks: dict[object, tuple[shared_memory.SharedMemory, SharedStore]] = {}  # by cache key
+
+    def share(self, cache) -> SharedStore:
+        '''Copy the complete path records of `cache` (a cache_manager.PathCache) into shared memory, once'''
+        if cache.key not in self.blocks:
+            paths = cache.grids_with_complete_paths
+            records = path_cache.edge_matrix(cache.grid, paths)
+            shm = shared_memory.SharedMemory(create=True, size=max(records.nbytes, 1))
+            shm.buf[:records.nbytes] = records.reshape(-1)
+            backend = next(name for name, cls in bitgrid.GRID_BACKENDS.items() if type(cache.grid) is cls)
+            g = cache.grid
+            store = SharedStore(shm.name, backend, g.width, g.height, g.start, g.end, len(paths), records.shape[1])
+            self.blocks[cache.key] = shm, store
+        return self.blocks[cache.key][1]
+
+    def filter(self, cache, path_ids: np.ndarray, cells: CellGrid, broken_edges: set[PointPair],
+               is_tri_puzzle: bool, first_only: bool) -> np.ndarray:
+        '''Return the ids in `path_ids` (ascending) whose paths solve the puzzle. If `first_only`, only the lowest
+        matching id is returned, and the chunks that start above a match found so far are cancelled.'''
+        store = self.share(cache)
+        self.best.value = NO_MATCH
+        futures = {self.pool.submit(_check_chunk, store, path_ids[i:i + CHUNK_SIZE], cells, broken_edges,
+                                    is_tri_puzzle, first_only): int(path_ids[i])
+                   for i in range(0, len(path_ids), CHUNK_SIZE)}  # future -> first path id of its chunk
+        if not first_only:
+            return np.array([path_id for future in futures for path_id in future.result()], dtype=np.int64)
+
+        best = NO_MATCH
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if not future.cancelled() and future.result():
+                    best = min(best, future.result()[0])
+            for future in pending:
+                if futures[future] > best:
+                    future.cancel()  # chunks already running stop at their next look at the lowest match
+        return np.array([] if best == NO_MATCH else [best], dtype=np.int64)
+
+    def close(self) -> None:
+        self.pool.shutdown(cancel_futures=True)
+        for shm, _ in self.blocks.values():
+            shm.close()
+            shm.unlink()
+        self.blocks.clear()
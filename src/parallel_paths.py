@@ -0,0 +1,75 @@
+# Enumerates all paths of a grid in several processes, for building path caches (see Grid.calc_paths()).
+#
+# The search tree is split on the first few moves. Paths shorter than the split depth are handled in place and the
+# subtree under every path of exactly that depth is walked by a worker process. The workers return edge bitmask
+# records (see path_cache.py) and the results are joined back in the order of the prefixes, so the output is byte for
+# byte the same as the serial walk.
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import bitgrid
+import path_cache
+from typ import PointPath
+
+PREFIX_DEPTH = 5  # moves expanded in place. Splits a grid from a corner into 58 subtrees, enough to keep 8+ CPUs busy.
+
+
+def split_prefixes(grid, depth: int = PREFIX_DEPTH) -> list[tuple[PointPath, bool]]:
+    '''Return the paths of up to `depth` moves grown from the end of the grid's path, in the order of Grid._walk().
+    Each path is flagged True if its whole subtree (the path itself included) is left to a worker.'''
+    adjacency = grid.adjacency()
+
+    # Same rule as Grid._walk(): points touched by active edges are visited
+    visited = {grid.path[-1]}
+    for pair, state in grid.edges.items():
+        if state == True:
+            visited.update(pair)
+
+    prefixes = []
+
+    def expand(path: PointPath) -> None:
+        for hop, _ in adjacency[path[-1]]:
+            if hop in visited:
+                continue
+            new_path = path + [hop]
+            if len(new_path) - len(grid.path) == depth:
+                prefixes.append((new_path, True))
+                continue
+            prefixes.append((new_path, False))
+            visited.add(hop)
+            expand(new_path)
+            visited.remove(hop)
+
+    expand(list(grid.path))
+    return prefixes
+
+
+def _subtree_records(grid, path: PointPath) -> tuple[bytes, bytes]:
+    '''Worker: records of `path` and every path grown from it, as (all paths, complete paths)'''
+    table = bitgrid.edge_table(grid.width, grid.height)
+    record = path_cache.encode_path(table, path).to_bytes(path_cache.record_size(table), 'little')
+    records, complete_records = path_cache.walk_records(grid.copy_with_path(path))
+    return record + records, (record if path[-1] == grid.end else b'') + complete_records
+
+
+def path_records(grid, workers: int | None = None, depth: int = PREFIX_DEPTH) -> tuple[bytes, bytes]:
+    '''Return the records of (all paths, complete paths) grown from the grid's path, using `workers` processes
+    (None = one per CPU). Same order as Grid.find_all_paths().'''
+    prefixes = split_prefixes(grid, depth)
+    subtrees = [path for path, is_subtree in prefixes if is_subtree]
+    with ProcessPoolExecutor(workers) as pool:
+        results = pool.map(_subtree_records, itertools.repeat(grid, len(subtrees)), subtrees)
+
+        table = bitgrid.edge_table(grid.width, grid.height)
+        size = path_cache.record_size(table)
+        records, complete_records = [], []
+        for path, is_subtree in prefixes:
+            if is_subtree:
+                subtree, complete_subtree = next(results)
+                records.append(subtree)
+                complete_records.append(complete_subtree)
+                continue
+            record = path_cache.encode_path(table, path).to_bytes(size, 'little')
+            records.append(record)
+            if path[-1] == grid.end:
+                complete_records.append(record)
+    return b''.join(records), b''.join(complete_records)
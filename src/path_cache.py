@@ -0,0 +1,161 @@
+# Compact binary cache of all paths through a grid. See Grid.calc_paths()
+#
+# Layout (little endian):
+#   header:  magic b'WPC1', width, height, start x, start y, end x, end y (uint16 each), record size in bytes,
+#            number of paths, number of complete paths (uint32 each)
+#   records: one edge bitmask per path (bit order of bitgrid.EdgeTable), all paths first, then the complete paths
+#
+# A path is a simple path from the start point, so its points can be rebuilt from the edge bitmask alone. Records are
+# decoded lazily from a memory mapped file, so opening a cache is close to instant and the file does not depend on
+# Python module paths the way a pickle does.
+import itertools
+import mmap
+import struct
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Iterable, Iterator
+import numpy as np
+import bitgrid
+from typ import Point, PointPair, PointPath
+
+MAGIC = b'WPC1'
+HEADER = struct.Struct('<4s6H3I')
+
+
+class PathStore(Sequence):
+    '''Read-only sequence of grids with paths, decoded on access from fixed-width edge bitmask records'''
+    def __init__(self, buf, offset: int, count: int, record_size: int, grid):
+        self.buf = buf
+        self.offset = offset
+        self.count = count
+        self.record_size = record_size
+        self.grid = type(grid)(grid.width, grid.height, grid.start, grid.end)  # clean template the returned grids are copied from
+        self.table: bitgrid.EdgeTable = bitgrid.edge_table(grid.width, grid.height)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self.count))]
+        if idx < 0:
+            idx += self.count
+        if not 0 <= idx < self.count:
+            raise IndexError(idx)
+        return self.grid.copy_with_path(self.path(idx))
+
+    def mask(self, idx: int) -> int:
+        '''Edge bitmask of the path with the given index'''
+        start = self.offset + idx * self.record_size
+        return int.from_bytes(self.buf[start:start + self.record_size], 'little')
+
+    def path(self, idx: int) -> PointPath:
+        return decode_path(self.table, self.grid.start, self.mask(idx))
+
+    def masks(self) -> Iterator[int]:
+        for idx in range(self.count):
+            yield self.mask(idx)
+
+    def records(self) -> memoryview:
+        '''Raw bytes of all records, `record_size` bytes each'''
+        return memoryview(self.buf)[self.offset:self.offset + self.count * self.record_size]
+
+
+def record_size(table: bitgrid.EdgeTable) -> int:
+    return (len(table.edges) + 7) // 8
+
+
+def encode_path(table: bitgrid.EdgeTable, path: PointPath) -> int:
+    mask = 0
+    for step in itertools.pairwise(path):
+        mask |= table.step_bit[step]
+    return mask
+
+
+def decode_path(table: bitgrid.EdgeTable, start: Point, mask: int) -> PointPath:
+    '''Rebuild the points of a path by following the edges in `mask` from `start`'''
+    moves = table.moves
+    path = [start]
+    cur = start
+    while mask:
+        for hop, bit, _ in moves[cur]:
+            if mask & bit:
+                break
+        else:
+            break
+        mask ^= bit  # edges are dropped once walked, so the path never turns back
+        path.append(hop)
+        cur = hop
+    return path
+
+
+def path_masks(grid, grids_with_paths) -> Iterable[int]:
+    '''Edge bitmasks of the given grids. Read straight from the records when they come from a PathStore.'''
+    if isinstance(grids_with_paths, PathStore):
+        return grids_with_paths.masks()
+    table = bitgrid.edge_table(grid.width, grid.height)
+    return (encode_path(table, g.path) for g in grids_with_paths)
+
+
+def edge_matrix(grid, grids_with_paths) -> np.ndarray:
+    '''Edge bitmasks of the given grids as a (number of paths, record size) uint8 matrix. For a PathStore this is a
+    zero-copy view of the memory mapped records.'''
+    table = bitgrid.edge_table(grid.width, grid.height)
+    size = record_size(table)
+    if isinstance(grids_with_paths, PathStore):
+        return np.frombuffer(grids_with_paths.records(), dtype=np.uint8).reshape(len(grids_with_paths), size)
+    data = b''.join(mask.to_bytes(size, 'little') for mask in path_masks(grid, grids_with_paths))
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, size)
+
+
+def drawable_ids(grid, edges: np.ndarray, edges_to_del: set[PointPair]) -> np.ndarray:
+    '''Return the ids of the paths in the `edges` matrix (see edge_matrix()) that use none of `edges_to_del`.
+    One vectorized AND over all records.'''
+    if not edges_to_del:
+        return np.arange(len(edges))
+    table = bitgrid.edge_table(grid.width, grid.height)
+    deleted = np.frombuffer(table.edges_mask(edges_to_del).to_bytes(edges.shape[1], 'little'), dtype=np.uint8)
+    return np.flatnonzero(~(edges & deleted).any(axis=1))
+
+
+def walk_records(grid) -> tuple[bytes, bytes]:
+    '''Return the records of (all paths, complete paths) grown from the end of the grid's path, in the order of
+    Grid.find_all_paths(). Encoded straight from the walk, so no Grid is built per path.'''
+    table = bitgrid.edge_table(grid.width, grid.height)
+    size = record_size(table)
+    records, complete_records = [], []
+    for path, _ in grid._walk(grid.path[-1]):
+        record = encode_path(table, path).to_bytes(size, 'little')
+        records.append(record)
+        if path[-1] == grid.end:
+            complete_records.append(record)
+    return b''.join(records), b''.join(complete_records)
+
+
+def pack_cache(grid, records: bytes, complete_records: bytes) -> bytes:
+    '''Return the bytes of a cache file holding the given records'''
+    size = record_size(bitgrid.edge_table(grid.width, grid.height))
+    header = HEADER.pack(MAGIC, grid.width, grid.height, *grid.start, *grid.end, size,
+                         len(records) // size, len(complete_records) // size)
+    return header + records + complete_records
+
+
+def read_cache(cache_file: str, grid) -> tuple[PathStore, PathStore]:
+    '''Memory map a cache file and return lazy stores of (all paths, complete paths). Grids use the class of `grid`.'''
+    with Path(cache_file).open('rb') as fin:
+        buf = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)  # the mapping stays valid after the file is closed
+    return open_cache(buf, grid, cache_file)
+
+
+def open_cache(buf, grid, name: str = 'buffer') -> tuple[PathStore, PathStore]:
+    '''Return lazy stores of (all paths, complete paths) over the bytes of a cache file (see pack_cache())'''
+    magic, width, height, start_x, start_y, end_x, end_y, size, num_paths, num_complete = HEADER.unpack_from(buf)
+    if magic != MAGIC:
+        raise RuntimeError(f'{name} is not a path cache file')
+    if (width, height, (start_x, start_y), (end_x, end_y)) != (grid.width, grid.height, grid.start, grid.end):
+        raise RuntimeError(f'{name} holds paths for a {width}x{height} grid from {(start_x, start_y)} to '
+                           f'{(end_x, end_y)}, not {grid.width}x{grid.height} from {grid.start} to {grid.end}')
+
+    grids_with_paths = PathStore(buf, HEADER.size, num_paths, size, grid)
+    grids_with_complete_paths = PathStore(buf, HEADER.size + num_paths * size, num_complete, size, grid)
+    return grids_with_paths, grids_with_complete_paths
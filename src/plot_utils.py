@@ -1,18 +1,26 @@
-# Shared utilities that leverage matplotlib's plt lib
-from matplotlib import pyplot as plt
+# Shared utilities that leverage matplotlib's plt lib.
+# matplotlib is only imported when something is drawn. Importing it takes longer than the rest of the solver's
+# startup, and solves that do not show debug images never need it.
 import cfg
 
 
+def _plt():
+    from matplotlib import pyplot as plt
+    return plt
+
+
 def show(img):
     '''Nice interactive image viewer with matplotlib plt module'''
     if cfg.SHOW_DEBUG_IMG:
         print(img)
+        plt = _plt()
         plt.imshow(img)
         plt.show()
 
 
 def run_anim(img_generator, delay=1.0):
     '''Pass in generator that produces PIL.Images and draw them in sequence as an animation in the plt viewer'''
+    plt = _plt()
     figure, axis = plt.gcf(), plt.gca()
     axis_image = axis.imshow(next(img_generator))
 
@@ -31,6 +39,7 @@ def run_anim(img_generator, delay=1.0):
 
 def run_live_img(app, delay=0.1):
     '''Simple utility function that allows for simplistic app'''
+    plt = _plt()
     if hasattr(app, 'on_click'):
         plt.connect('button_press_event', app.on_click)
     if hasattr(app, 'on_key'):
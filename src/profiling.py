@@ -0,0 +1,131 @@
+# Profiling mode of runner.py and runner_all.py (--profile). Shows where the time of a solve, or of a whole batch, went
+# without editing any code.
+#
+# Two profilers:
+#   sample    (default) a thread reads the stack of the profiled thread every few milliseconds. Low overhead, so the
+#             times stay close to a normal run. Writes collapsed stacks ("a;b;c 12" per line), the input of
+#             flamegraph.pl, speedscope and inferno.
+#   cprofile  counts every call with cProfile. Exact call counts, but every Python call gets slower, which inflates
+#             the small hot functions. Writes a .prof file (pstats, snakeviz, flameprof).
+# Both print a table of the hottest functions and the time spent in the functions we keep an eye on (WATCHED).
+import contextlib
+import cProfile
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+MODES = ('sample', 'cprofile')
+SAMPLE_INTERVAL = 0.002  # seconds between stack samples
+TOP = 25  # functions in the table
+WATCHED = ('calc_edge', 'label_regions', 'getpixel', 'deepcopy')
+
+
+def frame_name(code) -> str:
+    return f'{Path(code.co_filename).stem}.{code.co_qualname}'
+
+
+class Sampler:
+    '''Samples the stack of one thread from a background thread and counts each distinct stack'''
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter[tuple[str, ...]] = Counter()  # outermost frame first
+        self.running = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while self.running.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def start(self):
+        self.running.set()
+        self.thread.start()
+
+    def stop(self):
+        self.running.clear()
+        self.thread.join()
+
+    def collapsed(self) -> str:
+        '''Stacks in the collapsed format of flamegraph tools'''
+        return ''.join(f'{";".join(stack)} {count}\n' for stack, count in self.stacks.items())
+
+    def function_samples(self) -> tuple[Counter, Counter]:
+        '''Samples per function: on top of the stack (self), and anywhere in the stack (total)'''
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                total[name] += count
+        return own, total
+
+    def report(self, wall: float, top: int = TOP) -> str:
+        num_samples = sum(self.stacks.values())
+        if num_samples == 0:
+            return 'Profile: no samples, the run was shorter than the sample interval'
+        own, total = self.function_samples()
+        lines = [f'Profile: {num_samples} samples over {wall:.3f}s',
+                 f'{"self":>7}{"total":>8}{"total s":>9}  function']
+        for name, count in own.most_common(top):
+            lines.append(f'{count / num_samples:>7.1%}{total[name] / num_samples:>8.1%}'
+                         f'{total[name] / num_samples * wall:>9.3f}  {name}')
+        lines.append('Watched (total):')
+        for watched in WATCHED:
+            count = sum(c for name, c in total.items() if name.rsplit('.', 1)[-1] == watched)
+            lines.append(f'{count / num_samples:>15.1%}{count / num_samples * wall:>9.3f}  {watched}')
+        return '\n'.join(lines)
+
+
+def cprofile_report(profiler: cProfile.Profile, top: int = TOP) -> str:
+    stats = pstats.Stats(profiler).stats  # (file, line, name) -> (primitive calls, calls, own time, cumulative, callers)
+    total_time = sum(tt for _, _, tt, _, _ in stats.values())
+    lines = [f'Profile: {sum(nc for _, nc, _, _, _ in stats.values())} calls, {total_time:.3f}s of profiled time',
+             f'{"self s":>9}{"cum s":>9}{"calls":>10}  function']
+    ranked = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)
+    for (file, line, name), (_, nc, tt, ct, _) in ranked[:top]:
+        lines.append(f'{tt:>9.3f}{ct:>9.3f}{nc:>10}  {Path(file).stem}.{name}:{line}')
+    lines.append('Watched (cumulative):')
+    for watched in WATCHED:
+        found = [(nc, ct) for (_, _, name), (_, nc, _, ct, _) in stats.items() if name.rsplit('.', 1)[-1] == watched]
+        lines.append(f'{sum(ct for _, ct in found):>9.3f}{"":>9}{sum(nc for nc, _ in found):>10}  {watched}')
+    return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def profile(out_prefix: str = 'profile', mode: str = 'sample', top: int = TOP):
+    '''Profile the calling thread for the duration of the block. The profile is written next to `out_prefix`
+    (.collapsed or .prof) and a table of the hottest functions is printed.'''
+    if mode == 'sample':
+        sampler = Sampler(threading.get_ident())
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            out_file = f'{out_prefix}.collapsed'
+            Path(out_file).write_text(sampler.collapsed())
+            print(sampler.report(time.perf_counter() - start, top))
+            print(f'Collapsed stacks written to {out_file}')
+    elif mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            out_file = f'{out_prefix}.prof'
+            profiler.dump_stats(out_file)
+            print(cprofile_report(profiler, top))
+            print(f'cProfile stats written to {out_file}')
+    else:
+        raise ValueError(f'Unknown profile mode {mode!r}, expected one of {MODES}')
@@ -2,10 +2,13 @@ import datetime
 import copy
 import itertools
 from pathlib import Path
-import pickle
+from typing import Callable, Iterable, Iterator, TYPE_CHECKING
 import cfg
 import utils
+from spans import traced
 from typ import Point, PointPair, GridEdges, PointPath, Region, Regions
+if TYPE_CHECKING:
+    from constraints import PathConstraint
 
 
 class RegionsWrapper:
@@ -22,11 +25,12 @@ class RegionsWrapper:
 
 class Grid:
     '''Origin is at top-left'''
-    def __init__(self, width, height):
+    def __init__(self, width, height, start: Point | None = None, end: Point | None = None):
+        '''`start` and `end` default to the bottom-left and top-right corners'''
         self.width: int = width
         self.height: int = height
-        self.start: Point = (0, height - 1)
-        self.end: Point = (width - 1, 0)
+        self.start: Point = (0, height - 1) if start is None else start
+        self.end: Point = (width - 1, 0) if end is None else end
         self.edges: GridEdges = {}
         self.path: PointPath = [self.start]
         self.cells: tuple[tuple[str]] | None = None
@@ -108,79 +112,48 @@ class Grid:
         return len(activated_edges)
 
     def get_cell_points(self) -> list[Point]:
-        return [(x, y) for y in range(self.width - 1) for x in range(self.height - 1)]
+        return [(x, y) for y in range(self.height - 1) for x in range(self.width - 1)]
+
+    def label_regions(self) -> list[list[int]]:
+        '''Return a region label for every cell, indexed as [y][x] like `cells`. Labels count up from 0.
+
+        One pass over the cells with union-find: each cell is joined with its right and down neighbour unless an active
+        (path) edge lies between them. A missing edge does not separate cells.'''
+        w, h = self.width - 1, self.height - 1
+        parent = list(range(w * h))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        edges = self.edges
+        for y in range(h):
+            for x in range(w):
+                idx = y * w + x
+                if x + 1 < w and not edges.get(self.calc_edge((x, y), cfg.RIGHT), False):
+                    parent[find(idx + 1)] = find(idx)
+                if y + 1 < h and not edges.get(self.calc_edge((x, y), cfg.DOWN), False):
+                    parent[find(idx + w)] = find(idx)
+
+        return self._labels_from_roots([find(i) for i in range(w * h)])
+
+    def _labels_from_roots(self, roots: list[int]) -> list[list[int]]:
+        '''Renumber union-find roots (one per cell, row-major) to labels counting up from 0'''
+        w = self.width - 1
+        ids: dict[int, int] = {}
+        flat = [ids.setdefault(r, len(ids)) for r in roots]
+        return [flat[y * w:(y + 1) * w] for y in range(self.height - 1)]
 
     def get_regions_wrapper(self) -> RegionsWrapper:
         final_regions = RegionsWrapper()
-
-        # while points exist that are not classified into regions...
-        while True:
-            all_cell_points = set(self.get_cell_points())
-            points_in_regions = set(final_regions.get_points())
-            if len(all_cell_points - points_in_regions) == 0:
-                return final_regions
-
-            # Create and grow new region
-            start = list(all_cell_points - points_in_regions)[0]
-            region = self.make_region(start)
-
-            final_regions.regions.append(region)
-
-    def make_region(self, start: Point) -> Region:
-        region = set([start])
-        has_stepped: set[Point] = set()
-        while True:
-            new_region = self.grow_step(region, has_stepped)
-            if len(new_region) == len(region):
-                return region
-            else:
-                region = new_region
-
-    def grow_step(self, region: Region, has_stepped: set[Point]) -> Region:
-        new_region = region.copy()
-        # tracking and checking `has_stepped` is an optimization that shrunk the "find_solutions" time 50%.
-        for p in [pt for pt in region if pt not in has_stepped]:
-            growth = self.grow_around_point(p)
-            has_stepped.add(p)
-            new_region.update(growth)
-        return new_region
-
-    def grow_around_point(self, point: Point) -> set[Point]:
-        '''Return a set of Points around the given points after "growing" the point.
-        Note: A `Point` in this function represents the location of a cell, NOT an intersection of grid lines.'''
-
-        # BUG: This method doesn't properly handle a grid with some edges missing. It does function properly on a full
-        # grid. I currently don't use this function to handle grids with missing edges.  But, to get around this, I have
-        # higher level functions in the puzzle solving logic that do logic with missing edges and eliminates those paths.
-        # That was easier than making this function more general.
-        #
-        # Description of bug: With the code below as written, a new edge from calc_edge() is a 'no edge', the "growth"
-        # is halted in that direction. But when an internal edge is removed, the growth of a Region should continue.
-        # But in this current implementation, a region is blocked by a missing edge.
-        points = set()
-        # If and edge exists and the edge's state is False, the "grow" is valid
-
-        if not self.edges.get(self.calc_edge(point, cfg.RIGHT), 'no edge'):
-            # p = utils.pt_add(point, cfg.RIGHT)  # removed for potential optimization
-            p = point[0] + cfg.RIGHT[0], point[1] + cfg.RIGHT[1]
-            if utils.pt_in_bounds(p, self.width - 1, self.height - 1):
-                points.add(p)
-        if not self.edges.get(self.calc_edge(point, cfg.UP), 'no edge'):
-            # p = utils.pt_add(point, cfg.UP)
-            p = point[0] + cfg.UP[0], point[1] + cfg.UP[1]
-            if utils.pt_in_bounds(p, self.width - 1, self.height - 1):
-                points.add(p)
-        if not self.edges.get(self.calc_edge(point, cfg.LEFT), 'no edge'):
-            # p = utils.pt_add(point, cfg.LEFT)
-            p = point[0] + cfg.LEFT[0], point[1] + cfg.LEFT[1]
-            if utils.pt_in_bounds(p, self.width - 1, self.height - 1):
-                points.add(p)
-        if not self.edges.get(self.calc_edge(point, cfg.DOWN), 'no edge'):
-            # p = utils.pt_add(point, cfg.DOWN)
-            p = point[0] + cfg.DOWN[0], point[1] + cfg.DOWN[1]
-            if utils.pt_in_bounds(p, self.width - 1, self.height - 1):
-                points.add(p)
-        return points
+        regions: dict[int, Region] = {}
+        for y, row in enumerate(self.label_regions()):
+            for x, label in enumerate(row):
+                regions.setdefault(label, set()).add((x, y))
+        final_regions.regions = list(regions.values())
+        return final_regions
 
     def calc_edge(self, point: Point, direction: Point) -> PointPair:
         '''Given a Point (that identifies a cell), return the Edge that lies in the direction given
@@ -199,35 +172,148 @@ class Grid:
         else:
             raise RuntimeError('Unexpected direction: {direction}')
 
+    def adjacency(self) -> dict[Point, list[tuple[Point, PointPair]]]:
+        '''Map each point to the (hop, edge) pairs that can be traveled from it, in RIGHT, DOWN, LEFT, UP order.
+        Edges that are missing (deleted) or already active are not included.'''
+        adjacency = {}
+        for y in range(self.height):
+            for x in range(self.width):
+                pt = (x, y)
+                moves = []
+                for d in (cfg.RIGHT, cfg.DOWN, cfg.LEFT, cfg.UP):
+                    hop = pt[0] + d[0], pt[1] + d[1]
+                    pair = frozenset((pt, hop))
+                    if self.edges.get(pair, True) == False:
+                        moves.append((hop, pair))
+                adjacency[pt] = moves
+        return adjacency
+
+    def _walk(self, cur_point: Point, complete_only: bool = False,
+              constraint: 'PathConstraint | None' = None) -> Iterator[tuple[PointPath, list[PointPair]]]:
+        '''Depth-first enumeration of every path that can be grown from `cur_point`.
+
+        A single mutable path is grown and shrunk with push/pop backtracking, so nothing is copied per step. Yields the
+        live `path` and `pairs` lists after every move, in the same order as the recursion in find_all_paths() used to.
+        The yielded lists are reused, so callers must copy anything they want to keep.
+        If `complete_only` is True, only paths that end on `self.end` are yielded and the search does not continue
+        through the end point (no complete path can come back to it).
+        If a `constraint` is given (see constraints.py), branches it rejects are cut and paths reaching the end are
+        only yielded if the constraint reports them as solved.'''
+        adjacency = self.adjacency()
+
+        # Same rule as valid_moves(): points touched by active edges are visited
+        visited = {cur_point}
+        for pair, state in self.edges.items():
+            if state == True:
+                visited.update(pair)
+
+        path = list(self.path)
+        pairs: list[PointPair] = []
+        end = self.end
+        stack = [iter(adjacency[cur_point])]
+        while stack:
+            for hop, pair in stack[-1]:
+                if hop in visited:
+                    continue
+                if constraint is not None and not constraint.push(path[-1], hop):
+                    constraint.pop(path[-1], hop)
+                    continue
+                visited.add(hop)
+                path.append(hop)
+                pairs.append(pair)
+                if hop == end:
+                    if constraint is None or constraint.is_solved():
+                        yield path, pairs
+                    if complete_only:
+                        stack.append(iter(()))  # dead end, pop it right away
+                        break
+                elif not complete_only:
+                    yield path, pairs
+                stack.append(iter(adjacency[hop]))
+                break
+            else:
+                stack.pop()
+                if stack:
+                    if constraint is not None:
+                        constraint.pop(path[-2], path[-1])
+                    visited.remove(path.pop())
+                    pairs.pop()
+
+    def walk_paths(self, cur_point: Point) -> Iterator[tuple[Point, ...]]:
+        '''Yield the points of every path that can be grown from `cur_point` (partial and complete paths)'''
+        for path, pairs in self._walk(cur_point):
+            yield tuple(path)
+
+    def with_path(self, path: PointPath, pairs: list[PointPair]) -> 'Grid':
+        '''Return a lightweight copy of this grid with the given path activated. `pairs` are the edges walked after
+        the current path.'''
+        g = copy.copy(self)
+        g.edges = self.edges.copy()
+        for pair in pairs:
+            g.edges[pair] = True
+        g.path = list(path)
+        return g
+
+    def copy_with_path(self, path: PointPath) -> 'Grid':
+        '''Return a copy of this grid (which has no path yet) with the given full path activated'''
+        return self.with_path(path, [frozenset(pair) for pair in itertools.pairwise(path)])
+
+    @traced()
     def find_all_paths(self, cur_point: Point) -> list['Grid']:
         '''Given a grid, return a list of grids that contain paths that start/end at the start/end'''
-        results: list[Grid] = []
-        for pt in self.valid_moves(cur_point):
-            g = copy.deepcopy(self)
-            g.add_link(cur_point, pt)  # creates new link and adds to grid.path
-            results.append(g)
-            results.extend(g.find_all_paths(pt))
-        return results
-
-    def calc_paths(self, cache_file: str = ''):
+        return [self.with_path(path, pairs) for path, pairs in self._walk(cur_point)]
+
+    def iter_paths(self, constraint: 'PathConstraint | None' = None) -> Iterator['Grid']:
+        '''Lazily yield grids with complete paths (continuing the current path to the end), one at a time.
+        Unlike find_all_paths(), nothing is enumerated beyond what the caller consumes. An optional `constraint` (see
+        constraints.py) prunes the search while the path grows.'''
+        for path, pairs in self._walk(self.path[-1], complete_only=True, constraint=constraint):
+            yield self.with_path(path, pairs)
+
+    def iter_solutions(self, is_solved: Callable[['Grid'], bool],
+                       candidates: Iterable['Grid'] | None = None) -> Iterator['Grid']:
+        '''Lazily yield the grids with complete paths that `is_solved` accepts (ex: Grid.is_solved_tri_puzzle).
+        The cells of this grid are set on each candidate before it is checked. Candidates default to iter_paths(), but a
+        precalculated list (ex: from calc_paths()) can be given instead.'''
+        if candidates is None:
+            candidates = self.iter_paths()
+        for g in candidates:
+            g.set_cells(self.cells)
+            if is_solved(g):
+                yield g
+
+    @traced()
+    def calc_paths(self, cache_file: str = '', workers: int = 0):
         '''Wrapper function around find_all_paths() that either calls find_all_paths() or reads the results from a cache.
-        Caches generated data to disk if a `cache_file` name is provided'''
+        Caches generated data to disk if a `cache_file` name is provided. Grids read from the cache are decoded lazily
+        (see path_cache.py).
+        When a cache file is written, or `workers` is given, the paths are encoded to records as they are walked (in
+        that many processes, see parallel_paths.py) instead of built as grids, and returned as lazy stores too. That
+        keeps the build of large grids in memory. The results are the same as the serial ones.'''
+        import path_cache  # not imported at the top, path_cache depends on this module
 
         cache = Path(cache_file)
-        if cache_file == '' or not cache.exists():
-            print('Calculating full set of paths... This may take a couple minutes.')
+        if cache_file != '' and cache.exists():
+            print(f'Reading cached results from {cache_file}.')
+            return path_cache.read_cache(cache_file, self)
+
+        print('Calculating full set of paths... This may take a couple minutes.')
+        if not workers and cache_file == '':
             grids_with_paths = self.find_all_paths(self.start)
             grids_with_complete_paths = [g for g in grids_with_paths if g.path[-1] == g.end]
-            if cache_file != '':  # only write if file was provided
-                print(f'Writing results cache to {cache_file}')
-                with cache.open('wb') as fout:
-                    pickle.dump((grids_with_paths, grids_with_complete_paths), fout)
-        else:
-            print(f'Reading cached results from {cache_file}.')
-            with cache.open('rb') as fin:
-                grids_with_paths, grids_with_complete_paths = pickle.load(fin)
+            return grids_with_paths, grids_with_complete_paths
 
-        return grids_with_paths, grids_with_complete_paths
+        if workers:
+            import parallel_paths
+            records = parallel_paths.path_records(self, workers)
+        else:
+            records = path_cache.walk_records(self)
+        data = path_cache.pack_cache(self, *records)
+        if cache_file != '':
+            print(f'Writing results cache to {cache_file}')
+            with utils.atomic_write(cache_file) as fout:
+                fout.write(data)
+        return path_cache.open_cache(data, self)
 
     def is_solved_tri_puzzle(self) -> bool:
         '''Return True if the given Grid, cells and path are a solved Triangle puzzle'''
@@ -244,14 +330,14 @@ class Grid:
 
     def is_solved_region_puzzle(self, edges_to_del: set[PointPair]) -> bool:
         '''Return True if the given Grid, cells and path are a solved Region puzzle'''
-        for region in self.get_regions_wrapper().regions:
-            # get cell values for each point in region
-            colors = [self.cells[point[1]][point[0]] for point in region]
-            # strip out whitespace and count number of unique colors
-            colors = {c for c in colors if c.strip() != ''}  # use set for uniqueness
-            # if any region has > 1 unique cell color, fail solution
-            if len(colors) > 1:
-                return False
+        # color of each region (by label). If any region has > 1 unique cell color, fail solution
+        region_colors: dict[int, str] = {}
+        for labels, cells in zip(self.label_regions(), self.cells):
+            for label, color in zip(labels, cells):
+                if color.strip() == '':
+                    continue
+                if region_colors.setdefault(label, color) != color:
+                    return False
 
         # Test if any of the path segments have been removed via `edges_to_del`.
         # This is possible because in general we are creating a grids with fully traversed paths (often loaded from
@@ -326,6 +412,42 @@ class TextGrid:
         self.grid[y][x] = char
 
 
+# Cell layouts of the 5x5 demo puzzles, also the standard inputs of benchmark.py
+DEMO_TRI_CELLS = [
+    (
+        ('3', ' ', ' ', ' '),
+        (' ', ' ', '2', '1'),
+        (' ', ' ', '1', ' '),
+        ('2', ' ', '1', ' '),
+    ),
+    (
+        (' ', ' ', ' ', ' '),
+        (' ', ' ', ' ', '1'),
+        ('2', ' ', '1', '1'),
+        (' ', '1', '2', ' '),
+    ),
+    (
+        ('1', ' ', ' ', ' '),
+        (' ', '2', '2', '1'),
+        (' ', '1', '2', ' '),
+        ('2', ' ', '1', ' '),
+    ),
+]
+DEMO_REGION_CELLS = (
+    ('b', ' ', 'b', 'w'),
+    ('w', ' ', 'w', ' '),
+    (' ', 'b', ' ', ' '),
+    ('w', ' ', ' ', 'w'),
+)
+DEMO_REGION_EDGES_TO_DEL: set[PointPair] = {
+    frozenset(((4, 4), (3, 4))),
+    frozenset(((3, 4), (3, 3))),
+    frozenset(((3, 3), (2, 3))),
+    frozenset(((3, 2), (3, 1))),
+    frozenset(((1, 2), (1, 1))),
+}
+
+
 def demo_simple():
     grid = Grid(3, 3)
     a, b, c = (1, 1), (2, 1), (2, 2)
@@ -377,33 +499,10 @@ def demo_tri():
 
 def demo_solve_tri_puzzles():
     '''precalculate grids and solve multiple puzzles, starting with the same grid (testing the optimization)'''
-    test_cells = []
-    test_cells.append(tuple((
-        ('3', ' ', ' ', ' '),
-        (' ', ' ', '2', '1'),
-        (' ', ' ', '1', ' '),
-        ('2', ' ', '1', ' '),
-    )))
-    test_cells.append(tuple((
-        (' ', ' ', ' ', ' '),
-        (' ', ' ', ' ', '1'),
-        ('2', ' ', '1', '1'),
-        (' ', '1', '2', ' '),
-    )))
-    test_cells.append(tuple((
-        ('1', ' ', ' ', ' '),
-        (' ', '2', '2', '1'),
-        (' ', '1', '2', ' '),
-        ('2', ' ', '1', ' '),
-    )))
-
     grid = Grid(5, 5)
-    # Note: If you create a cached paths pickle file with codepaths in puzzle.py, you can NOT load it in runner.py
-    # because the module paths stored in the .pickle file are not visible to runner.py. But, if the pickle file is
-    # generated in a runner.py codepath, code in puzzle.py will be able to load it.
-    grids_with_paths, grids_with_complete_paths = grid.calc_paths('grid_5x5.cache.pickle')
+    grids_with_paths, grids_with_complete_paths = grid.calc_paths('grid_5x5.paths.bin')
 
-    for cells in test_cells:
+    for cells in DEMO_TRI_CELLS:
         print('=' * 80, datetime.datetime.now())
         grid.set_cells(cells)
         print(grid)
@@ -418,19 +517,8 @@ def demo_solve_tri_puzzles():
 
 
 def demo_initial_region_solve():
-    cells = tuple((
-        ('b', ' ', 'b', 'w'),
-        ('w', ' ', 'w', ' '),
-        (' ', 'b', ' ', ' '),
-        ('w', ' ', ' ', 'w'),
-    ))
-    edges_to_del: set[PointPair] = {
-        frozenset(((4, 4), (3, 4))),
-        frozenset(((3, 4), (3, 3))),
-        frozenset(((3, 3), (2, 3))),
-        frozenset(((3, 2), (3, 1))),
-        frozenset(((1, 2), (1, 1))),
-    }
+    cells = DEMO_REGION_CELLS
+    edges_to_del = DEMO_REGION_EDGES_TO_DEL
 
     grid = Grid(5, 5)
     grid.set_cells(cells)
@@ -439,7 +527,7 @@ def demo_initial_region_solve():
     grid.delete_edges_from_path(edges_to_del)  # because paths are caching in calc_paths(), this deletion only is cosmetic for the print()
     print(grid)
 
-    grids_with_paths, grids_with_complete_paths = grid.calc_paths('grid_5x5.cache.pickle')
+    grids_with_paths, grids_with_complete_paths = grid.calc_paths('grid_5x5.paths.bin')
 
     ans = []
     for g in grids_with_complete_paths:
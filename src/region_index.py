@@ -0,0 +1,79 @@
+# Region labels of every complete path, stored as a NumPy matrix (one row per path, one column per cell).
+# The region partition of a path does not depend on the panel, only the cell colours do. So a Region puzzle can be
+# checked against every cached path in one batched pass instead of calling Grid.get_regions_wrapper() per path.
+from pathlib import Path
+from typing import Iterable
+import numpy as np
+import bitgrid
+import path_cache
+import utils
+from typ import CellGrid
+
+
+class RegionIndex:
+    def __init__(self, width: int, height: int, labels: np.ndarray):
+        self.width = width
+        self.height = height
+        self.labels = labels  # (number of paths, number of cells), cells in row-major order
+
+    @staticmethod
+    def build(width: int, height: int, masks: Iterable[int]) -> 'RegionIndex':
+        '''Build the label matrix from the edge bitmasks of the complete paths (path id = position in `masks`)'''
+        grid = bitgrid.BitGrid(width, height)
+        rows = []
+        for mask in masks:
+            grid.active = mask
+            rows.append([label for row in grid.label_regions() for label in row])
+        labels = np.array(rows, dtype=np.uint8).reshape(len(rows), (width - 1) * (height - 1))
+        return RegionIndex(width, height, labels)
+
+    def solved(self, cells: CellGrid, path_ids: np.ndarray | None = None) -> np.ndarray:
+        '''Return a boolean array telling for each path (or each of `path_ids`) if no region holds two colours'''
+        labels = self.labels if path_ids is None else self.labels[path_ids]
+        flat = [c for row in cells for c in row]
+        num_paths, num_cells = labels.shape
+        rows = np.arange(num_paths)[:, None]
+
+        # colours_seen[path, label] = number of different colours found in that region
+        colours_seen = np.zeros((num_paths, num_cells), dtype=np.uint8)
+        for color in {c for c in flat if c.strip() != ''}:
+            columns = [idx for idx, c in enumerate(flat) if c == color]
+            has_color = np.zeros((num_paths, num_cells), dtype=bool)
+            has_color[rows, labels[:, columns]] = True
+            colours_seen += has_color
+        return (colours_seen <= 1).all(axis=1)
+
+    def solved_ids(self, cells: CellGrid, path_ids: np.ndarray | None = None) -> np.ndarray:
+        '''Return the ids of the paths whose regions each hold a single colour'''
+        if path_ids is None:
+            return np.flatnonzero(self.solved(cells))
+        return path_ids[self.solved(cells, path_ids)]
+
+    def save(self, index_file: str) -> None:
+        with utils.atomic_write(index_file) as fout:
+            np.save(fout, self.labels)
+
+    @staticmethod
+    def load(index_file: str, width: int, height: int) -> 'RegionIndex':
+        return RegionIndex(width, height, np.load(index_file, mmap_mode='r'))
+
+
+def index_file_for(cache_file: str) -> str:
+    return str(Path(cache_file).with_suffix('.regions.npy'))
+
+
+def load_or_build(cache_file: str, grid, grids_with_complete_paths) -> RegionIndex:
+    '''Load the label matrix stored next to `cache_file`, or build it from the complete paths and store it there'''
+    index_file = index_file_for(cache_file)
+    expected_shape = (len(grids_with_complete_paths), (grid.width - 1) * (grid.height - 1))
+    if Path(index_file).exists():
+        print(f'Reading region labels from {index_file}.')
+        index = RegionIndex.load(index_file, grid.width, grid.height)
+        if index.labels.shape == expected_shape:
+            return index
+        print('Region labels do not match the path cache. Rebuilding them.')
+
+    print(f'Building region labels and writing them to {index_file}')
+    index = RegionIndex.build(grid.width, grid.height, path_cache.path_masks(grid, grids_with_complete_paths))
+    index.save(index_file)
+    return index
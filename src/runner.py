@@ -1,18 +1,30 @@
 import time
 import argparse
+import contextlib
 import copy
 import traceback
+from concurrent.futures import Future
+import numpy as np
 from PIL import Image, ImageFilter
-import keyboard
 import cfg
 import puzzle
+import bitgrid
+import constraints
+import path_cache
+import cache_manager
+import parallel_filter
+import solution_cache
+import zdd
 import img_proc
 import img_parsing
 import plot_utils
-from utils import timer
+import profiling
+import spans
+from spans import span
 
 
 def wait_for_keypress(keys: list[str]) -> str:
+    import keyboard  # only the realtime loop listens for hotkeys
     print('Waiting for keypress on', keys)
     while True:
         time.sleep(0.05)
@@ -20,40 +32,91 @@ def wait_for_keypress(keys: list[str]) -> str:
             if keyboard.is_pressed(key):
                 return key
 
-def load_initial_grid_cache(width, height):
-    '''Calculate grid paths or load from disk'''
-    print(f'Cache initial path info for grid {width}x{height}')
-    grid = puzzle.Grid(width, height)
-    grids_with_paths, grids_with_complete_paths = grid.calc_paths('grid_5x5.cache.pickle')
-    return grid, grids_with_paths, grids_with_complete_paths
+def load_initial_grid_cache(caches: cache_manager.CacheManager, width, height, startup: float) -> Future:
+    '''Calculate grid paths or load from disk, along with the triangle index and region labels stored next to them.
+    Runs in the background, a solve that comes in early waits for the parts it needs (see CacheManager.warm_up()).'''
+    print(f'Cache initial path info for grid {width}x{height} in the background')
 
-def preprocess_image(img: Image) -> Image:
-    '''Reduce the image down to a known list of colors to make parsing easier'''
-    print('Doing pre-processing on the image')
+    def report_ready(future: Future) -> None:
+        if future.exception() is not None:
+            print(f'Loading the initial cache failed: {future.exception()!r}')
+        else:
+            print(f'Startup to ready: {time.perf_counter() - startup:.3f}s')
+
+    future = caches.warm_up(width, height)
+    future.add_done_callback(report_ready)
+    return future
+
+
+MODE_FILTER_SIZE = 5  # pixels across the square the mode filter of the preprocessing takes each pixel's color from
+
+
+def reduce_colors(img: Image) -> Image:
+    '''Map every pixel to the nearest color of the puzzle's palette, then smooth out stray pixels with a mode filter'''
     palimage = Image.new('P', (16, 16))
     palimage.putpalette(cfg.Puzzle.palette)
     new_img = img.quantize(colors=len(cfg.Puzzle.palette) / 3, palette=palimage, dither=Image.Dither.NONE)
-    new_img = new_img.filter(ImageFilter.ModeFilter(5))
+    new_img = new_img.filter(ImageFilter.ModeFilter(MODE_FILTER_SIZE))
     return new_img
 
 
-def process_image(img, grid, grids_with_complete_paths):
-    with timer('3 preproc'):
+def preprocess_image(img: Image) -> Image:
+    '''Reduce the image down to a known list of colors to make parsing easier'''
+    print('Doing pre-processing on the image')
+    return reduce_colors(img)
+
+
+def reduce_colors_in(img: Image, box: tuple[int, int, int, int]) -> Image:
+    '''reduce_colors() of only the `box` part of `img`. Each pixel of the mode filter depends on the pixels up to
+    MODE_FILTER_SIZE // 2 away, so a margin that wide is reduced with the box and cropped off after. The result is the
+    same as the box of the whole reduced image.'''
+    margin = MODE_FILTER_SIZE // 2
+    x1, y1, x2, y2 = box
+    grown = max(0, x1 - margin), max(0, y1 - margin), min(img.width, x2 + margin), min(img.height, y2 + margin)
+    return reduce_colors(img.crop(grown)).crop((x1 - grown[0], y1 - grown[1], x2 - grown[0], y2 - grown[1]))
+
+
+def preprocess_panel(img: Image) -> tuple[Image, img_proc.Rect]:
+    '''Staged preprocess_image() and img_parsing.find_bounding_box() that only reduce the pixels the parsing reads:
+    first the whisker rows and columns the panel is found on, then the panel itself. Everything else of the returned
+    image is left blank. The panel's pixels, debug crosses included, are the same as with the whole frame reduced.'''
+    print('Doing pre-processing on the whiskers and the panel')
+    canvas = Image.new('P', img.size)
+    canvas.putpalette(cfg.Puzzle.palette)
+    boxes = [(int(x), 0, int(x) + 1, img.height) for x in cfg.Puzzle.PANEL_BOUNDING_BOX_WHISKER_START_X]
+    boxes += [(0, int(y), img.width, int(y) + 1) for y in cfg.Puzzle.PANEL_BOUNDING_BOX_WHISKER_START_Y]
+    for box in boxes:
+        canvas.paste(reduce_colors_in(img, box), box[:2])
+
+    crosses = []
+    bounding_box = img_parsing.find_bounding_box(canvas, crosses)
+    box = bounding_box.as_tuple()
+    canvas.paste(reduce_colors_in(img, box), box[:2])
+    img_parsing.draw_crosses(canvas, crosses)  # again, the panel was pasted over the ones that reach into it
+    return canvas, bounding_box
+
+
+def process_image(img, grid, cache=None, pool=None, memo=None):
+    '''Parse and solve a screenshot. Return the panel's cells, its broken edges and the answer paths.'''
+    with span('preproc'):
         assert img.size == (cfg.SCREEN_WIDTH, cfg.SCREEN_HEIGHT)
         plot_utils.show(img)
 
-        img = preprocess_image(img)
+        if cfg.SHOW_DEBUG_IMG:
+            img, bounding_box = preprocess_image(img), None  # the whole frame, for the debug views
+        else:
+            img, bounding_box = preprocess_panel(img)
         plot_utils.show(img)
 
     # parse image
-    with timer('3 details'):
+    with span('details'):
         print('Parse image to get info from it and update the grid with the found cells and edges')
-        cells, broken_edges = img_parsing.get_puzzle_details(img)
+        cells, broken_edges = img_parsing.get_puzzle_details(img, bounding_box)
 
     # print out grid for confirmation that processing worked
-    with timer('3 set cells'):
+    with span('set cells'):
         grid.set_cells(cells)
-    with timer('3 del edges'):
+    with span('del edges'):
         print('Grids edges:', len(grid.edges))
         for e in grid.edges:
             print(e)
@@ -63,46 +126,153 @@ def process_image(img, grid, grids_with_complete_paths):
         grid.delete_edges_from_path(broken_edges)
         print(grid)
 
+    # a panel that was solved before is answered from the memo, without filtering any paths
+    puzzle_type = type(cfg.Puzzle).__name__
+    if memo is not None:
+        with span('memo'):
+            paths = memo.get(puzzle_type, grid, cells, broken_edges, all_answers=cfg.SHOW_DEBUG_IMG)
+        if paths is not None:
+            for idx, path in enumerate(paths):
+                print(f'========== Solution #{idx} found in the memo')
+                print(grid.copy_with_path(path))
+            print(f'Found {len(paths)} answers')
+            return cells, broken_edges, paths
+
     # solve puzzle
-    with timer('3 solve'):
-        find_solutions(grids_with_complete_paths, broken_edges, cells)
+    with span('solve'):
+        answers = find_solutions(cache, broken_edges, cells, grid, pool)
+    paths = [g.path for g in answers]
+    if memo is not None and paths:
+        memo.put(puzzle_type, grid, cells, broken_edges, paths, complete=cfg.SHOW_DEBUG_IMG)  # see find_solutions()
+    return cells, broken_edges, paths
 
 
-def find_solutions(grids_with_complete_paths, broken_edges, cells):
-    print(f'Given {len(grids_with_complete_paths)} full paths, filter results down to the solutions that match the constraints.')
-    answers = []
+def find_solutions(cache, broken_edges, cells, grid, pool=None):
+    '''Filter full paths down to the solutions. If `cache` (a cache_manager.PathCache) is None, full paths are streamed
+    from `grid` instead, so the enumeration stops as soon as the first answer is found. `grid` has had its broken edges
+    deleted, so only the edges that remain are searched. With a cache,
+    paths that cross a broken edge are dropped first. Triangle puzzles are then looked up in the triangle index (see
+    tri_index.py) and Region puzzles are filtered in one batch with the region labels (see region_index.py).
+    If a `pool` (a parallel_filter.FilterPool) is given, the remaining paths are checked by its workers instead.'''
+    full_grid = bitgrid.make_grid(grid.width, grid.height, grid.start, grid.end)  # `grid` has had its broken edges deleted
+    full_grid.set_cells(cells)
     is_tri_puzzle = isinstance(cfg.Puzzle, cfg.Triangle)
-    for idx, grid_with_path in enumerate(grids_with_complete_paths):
-        grid_with_path.set_cells(cells)
+    if is_tri_puzzle:
+        is_solved = puzzle.Grid.is_solved_tri_puzzle
+    else:
+        is_solved = lambda g: g.is_solved_region_puzzle(broken_edges)
+
+    if cache is None:
+        print('Streaming full paths on the grid without its broken edges, pruned by the constraints.')
         if is_tri_puzzle:
-            is_solved = grid_with_path.is_solved_tri_puzzle()
+            # the diagram of the remaining edges, cut down to the paths that meet every count (see zdd.py)
+            diagram = zdd.PathZdd.build(grid).with_triangles(cells)
+            print(f'{diagram.count()} paths meet the triangle counts.')
+            candidates = (grid.copy_with_path(path) for path in diagram.paths())
         else:
-            is_solved = grid_with_path.is_solved_region_puzzle(broken_edges)
-        if is_solved:
-            print(f'========== Puzzle #{idx} of {len(grids_with_complete_paths)} is a solution')
-            print(grid_with_path)
-            answers.append(grid_with_path)
-            if not cfg.SHOW_DEBUG_IMG:
-                break  # only show first answer for speed
+            candidates = grid.iter_paths(constraints.RegionConstraint(grid))
+    else:
+        # Drop every path that crosses a broken edge first, so the checks below only see paths that can be drawn
+        grids_with_complete_paths = cache.grids_with_complete_paths
+        edges = path_cache.edge_matrix(full_grid, grids_with_complete_paths)
+        path_ids = path_cache.drawable_ids(full_grid, edges, broken_edges)
+        print(f'Given {len(grids_with_complete_paths)} full paths, {len(path_ids)} avoid the broken edges.')
+        if pool is not None:
+            print('Check them in the worker pool.')
+            path_ids = pool.filter(cache, path_ids, cells, broken_edges, is_tri_puzzle, first_only=not cfg.SHOW_DEBUG_IMG)
+            is_solved = lambda g: True  # the workers only return solutions
+        elif is_tri_puzzle:
+            print('Look up the solutions in the triangle index.')
+            path_ids = np.intersect1d(cache.tri_idx.lookup(cells), path_ids)
+            is_solved = lambda g: True  # the index only returns solutions
+        else:
+            print('Filter them by region colors in one batch.')
+            path_ids = cache.region_idx.solved_ids(cells, path_ids)
+        candidates = (grids_with_complete_paths[path_id] for path_id in path_ids)
+
+    answers = []
+    for grid_with_path in full_grid.iter_solutions(is_solved, candidates):
+        print(f'========== Solution #{len(answers)} found')
+        print(grid_with_path)
+        answers.append(grid_with_path)
+        if not cfg.SHOW_DEBUG_IMG:
+            break  # only show first answer for speed
     print(f'Found {len(answers)} answers')
     return answers
 
 
-def main(args):
+def solve_image(img, caches, pool=None, memo=None):
+    '''Solve the image with the path cache for the configured puzzle's grid size (or no cache if `caches` is None).
+    Return the results of process_image().'''
+    width, height = cfg.Puzzle.GRID_SIZE
+    if caches is None or not caches.available(width, height):
+        # Full paths are streamed from the grid without its broken edges for every solve. Also used for grid sizes
+        # that have no path cache yet, rather than stalling the solve to enumerate every path of the full grid.
+        return process_image(img, bitgrid.make_grid(width, height), memo=memo)
+    else:
+        cache = caches.get(width, height)
+        cur_grid = copy.deepcopy(cache.grid)  # grid is muted inside process_image
+        return process_image(img, cur_grid, cache, pool, memo)
+
+
+def main(args, caches: cache_manager.CacheManager | None = None):
+    '''Solve the image of the args, or keep solving screenshots. `caches` can be shared between calls (see
+    runner_all.py), otherwise a cache manager is made here unless --no-cache.'''
+    startup = time.perf_counter()
     if args.imgpath is not None:
         if args.puzzle_type is None:
             raise Exception('Must provide --puzzle-type if you provide --imgpath')
 
-    with timer('Initial load') as t:
-        grid, grids_with_paths, grids_with_complete_paths = load_initial_grid_cache(5, 5)
+    cfg.GRID_BACKEND = args.backend
+    spans.TRACER.enabled = not args.no_trace
+    if caches is None and not args.no_cache:
+        caches = cache_manager.CacheManager(max_bytes=args.cache_budget_mb * 1024 * 1024)
+    if caches is not None:
+        for width, height in cfg.grid_sizes():
+            load_initial_grid_cache(caches, width, height, startup)
+    # started once and kept warm across keypresses
+    pool = parallel_filter.FilterPool(args.filter_workers) if caches is not None and args.filter_workers else None
+    memo = None if args.no_memo else solution_cache.SolutionCache(cfg.SOLUTION_MEMO_FILE)
+    try:
+        solve_loop(args, caches, pool, memo, startup)
+    finally:
+        if pool is not None:
+            pool.close()
+        if memo is not None:
+            memo.close()
+        if args.trace_file:
+            spans.TRACER.export_chrome(args.trace_file)
+            print(f'Wrote Chrome trace of {len(spans.TRACER.events)} spans to {args.trace_file}')
+
+
+def report(caches, memo):
+    if spans.TRACER.enabled:
+        print(spans.TRACER.report())
+    if caches is not None:
+        print(caches.report())
+    if memo is not None:
+        print(memo.report())
+
+
+def profile_solve(args):
+    '''Profile one solve if --profile was given (see profiling.py)'''
+    if not args.profile:
+        return contextlib.nullcontext()
+    return profiling.profile(args.profile_out, args.profile)
+
+
+def solve_loop(args, caches, pool, memo, startup):
+    first_solve = True
 
     if args.imgpath:
         cfg.config_factory(args.puzzle_type)
         # use specified image file for one iteration
-        with timer('game img'):
+        with span('game img'):
             img = img_proc.get_game_image(args)
-        with timer('proc img'):
-            process_image(img, grid, grids_with_complete_paths)
+        with span('proc img'), profile_solve(args):
+            solve_image(img, caches, pool, memo)
+        print(f'Time to first solve: {time.perf_counter() - startup:.3f}s')
+        report(caches, memo)
     else:
         # realtime - grab screenshot from running game
         while True:
@@ -110,11 +280,11 @@ def main(args):
             print(f'Keypress: {key}')
 
             try:
-                with timer('1 Total'):
+                with span('total'):
                     key_map = {'1': 'Starter2Region', '2': 'TripletRegion', '3': 'Triangle', '0': 'NoOp'}
                     cfg.config_factory(key_map[key])
 
-                    with timer('2 get img'):
+                    with span('get img'):
                         img = img_proc.get_game_image(args)
                     print(img)
                     if cfg.Puzzle is None:
@@ -125,24 +295,36 @@ def main(args):
                             img_proc.get_game_image(args)
                             time.sleep(1.0)  # screenshots are named with per-second timestamps
                         continue
-                    with timer('2 proc img'):
-                        cur_grid = copy.deepcopy(grid)  # grid is muted inside process_image
-                        process_image(img, cur_grid, grids_with_complete_paths)
+                    with span('proc img'), profile_solve(args):
+                        solve_image(img, caches, pool, memo)
+                    if first_solve:
+                        first_solve = False
+                        print(f'Time to first solve: {time.perf_counter() - startup:.3f}s')
+                report(caches, memo)
             except Exception as exc:
                 print(''.join(traceback.format_exception(exc)))
                 print()
                 time.sleep(0.3)  # delay a bit otherwise the keypress will be detected multiple times
 
+
 def cli():
     parser = argparse.ArgumentParser(prog='Solvers for The Witness')
     parser.add_argument('--imgpath', help='Use the provided file instead of taking a screenshot')
     parser.add_argument('--puzzle-type', choices=cfg.PUZZLE_TYPES, help='Type of puzzle to solve')
     parser.add_argument('--save-screenshot', action='store_true', help='Save screenshot to a file before processing')
+    parser.add_argument('--backend', choices=bitgrid.GRID_BACKENDS, default=cfg.GRID_BACKEND, help='Grid implementation to solve with')
+    parser.add_argument('--no-cache', action='store_true', help='Stream paths for each solve instead of loading the path cache')
+    parser.add_argument('--cache-budget-mb', type=int, default=cfg.CACHE_BUDGET_MB, help='Memory the path caches of all grid sizes may hold')
+    parser.add_argument('--no-memo', action='store_true', help='Do not look up or store answers in the solution memo')
+    parser.add_argument('--filter-workers', type=int, default=cfg.FILTER_WORKERS, help='Check cached paths in this many worker processes. 0 = use the indexes in this process.')
+    parser.add_argument('--no-trace', action='store_true', help='Do not time the steps of each solve (see spans.py)')
+    parser.add_argument('--trace-file', help='Write the timed steps as Chrome trace-event JSON to this file on exit')
+    parser.add_argument('--profile', nargs='?', const='sample', choices=profiling.MODES, help='Profile each solve, by sampling (default) or with cProfile')
+    parser.add_argument('--profile-out', default='profile', help='Profile output file, without the extension')
     args = parser.parse_args()
     main(args)
 
 
 if __name__ == '__main__':
-    with timer('Total'):
-        cli()
+    cli()
 
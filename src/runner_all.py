@@ -1,9 +1,14 @@
 '''
 Run through a list of files. Serves as a type of regression test.
 '''
+import argparse
+import contextlib
 import datetime
 from dataclasses import dataclass
 import runner
+import cache_manager
+import profiling
+import spans
 import cfg
 
 FILE_AND_TYPE = (
@@ -25,20 +30,39 @@ FILE_AND_TYPE = (
 )
 
 def main():
+    parser = argparse.ArgumentParser(description='Solve every file of FILE_AND_TYPE')
+    parser.add_argument('--profile', nargs='?', const='sample', choices=profiling.MODES, help='Profile the whole batch, by sampling (default) or with cProfile')
+    parser.add_argument('--profile-out', default='profile', help='Profile output file, without the extension')
+    batch_args = parser.parse_args()
+
     cfg.SHOW_DEBUG_IMG = False  # hack to disable the display of debug images
 
     @dataclass
     class FakeArgs:
         imgpath: str
         puzzle_type: str
+        no_cache: bool = False
+        backend: str = cfg.GRID_BACKEND
+        cache_budget_mb: int = cfg.CACHE_BUDGET_MB
+        filter_workers: int = cfg.FILTER_WORKERS
+        no_memo: bool = True  # a regression run solves every image, never answers from the memo
+        no_trace: bool = False
+        trace_file: str | None = None
+        profile: str | None = None  # the batch is profiled as a whole instead
+        profile_out: str = 'profile'
 
-    for idx, (puzzle_type, name) in enumerate(FILE_AND_TYPE):
-        name = 'img/' + name
-        print()
-        print('=' * 80, f'#{idx} of {len(FILE_AND_TYPE)}', name, puzzle_type, datetime.datetime.now())
-        args = FakeArgs(name, puzzle_type)
-        runner.main(args)
+    # one cache manager for every image, so the path caches are loaded (or built) once
+    caches = cache_manager.CacheManager(max_bytes=FakeArgs.cache_budget_mb * 1024 * 1024)
+    profiler = profiling.profile(batch_args.profile_out, batch_args.profile) if batch_args.profile else contextlib.nullcontext()
+    with profiler:
+        for idx, (puzzle_type, name) in enumerate(FILE_AND_TYPE):
+            name = 'img/' + name
+            print()
+            print('=' * 80, f'#{idx} of {len(FILE_AND_TYPE)}', name, puzzle_type, datetime.datetime.now())
+            args = FakeArgs(name, puzzle_type)
+            runner.main(args, caches)
     print('Done', datetime.datetime.now())
+    print(spans.TRACER.report())  # over all the files
 
 
 if __name__ == '__main__':
@@ -0,0 +1,124 @@
+# Memo of solved panels, so a panel that has been solved before (in this session or an earlier one) is answered
+# without filtering any paths. See runner.process_image()
+#
+# Panels are keyed by (puzzle type, grid size, cells, broken edges). Before hashing, a panel is put in a canonical form
+# over the grid symmetries that keep the start and end points in place. With the start in the bottom left and the end
+# in the top right corner, that is the reflection over the anti-diagonal through both, which only exists for square
+# grids. Answers are stored in the canonical frame and mapped back to the frame of the panel they are returned for.
+#
+# Each entry records whether it holds every answer of the panel, or only the first one found (runner stops at the first
+# answer unless cfg.SHOW_DEBUG_IMG). A first-only entry does not answer a lookup that wants every answer.
+#
+# Recently used entries are held in memory, least recently used ones are dropped first. Every entry is also written to
+# a shelve file that outlives the session.
+import shelve
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+from typ import CellGrid, Point, PointPair, PointPath
+
+Transform = Callable[[Point], Point]
+
+
+@dataclass
+class MemoStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+def symmetries(width: int, height: int, start: Point, end: Point) -> list[tuple[Transform, Transform]]:
+    '''Return (point map, cell map) pairs of the grid symmetries that keep `start` and `end` in place, identity first'''
+    found = [(lambda pt: pt, lambda cell: cell)]
+    if width == height:
+        def point_map(pt: Point) -> Point:
+            return height - 1 - pt[1], width - 1 - pt[0]
+
+        def cell_map(cell: Point) -> Point:
+            return height - 2 - cell[1], width - 2 - cell[0]
+
+        if point_map(start) == start and point_map(end) == end:
+            found.append((point_map, cell_map))
+    return found
+
+
+def transform_panel(cells: CellGrid, broken_edges: set[PointPair], point_map: Transform,
+                    cell_map: Transform) -> tuple[CellGrid, tuple[tuple[Point, Point], ...]]:
+    '''Return the cells and (sorted) broken edges of a panel as seen through a grid symmetry'''
+    new_cells = [list(row) for row in cells]
+    for y, row in enumerate(cells):
+        for x, cell in enumerate(row):
+            new_x, new_y = cell_map((x, y))
+            new_cells[new_y][new_x] = cell
+    edges = tuple(sorted(tuple(sorted(point_map(pt) for pt in edge)) for edge in broken_edges))
+    return tuple(tuple(row) for row in new_cells), edges
+
+
+def canonical_key(puzzle_type: str, width: int, height: int, start: Point, end: Point, cells: CellGrid,
+                  broken_edges: set[PointPair]) -> tuple[str, Transform]:
+    '''Return the key of a panel and the point map between its frame and the canonical frame. Every symmetry used here
+    is its own inverse, so the same map works both ways.'''
+    candidates = []
+    for point_map, cell_map in symmetries(width, height, start, end):
+        new_cells, edges = transform_panel(cells, broken_edges, point_map, cell_map)
+        candidates.append((repr((puzzle_type, width, height, start, end, new_cells, edges)), point_map))
+    key, point_map = min(candidates, key=lambda c: c[0])
+    return key, point_map
+
+
+class SolutionCache:
+    '''Answer paths of solved panels, kept in memory (LRU) and in a shelve file'''
+    def __init__(self, store_file: str, max_entries: int = 256):
+        self.store = shelve.open(store_file)
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[bool, list[PointPath]]] = OrderedDict()  # (complete, paths)
+        self.stats = MemoStats()
+
+    def get(self, puzzle_type: str, grid, cells: CellGrid, broken_edges: set[PointPair],
+            all_answers: bool = False) -> list[PointPath] | None:
+        '''Return the answer paths of the panel (in the panel's own frame), or None if it was not solved before. With
+        `all_answers`, an entry that only holds the first answer found counts as not solved.'''
+        key, point_map = canonical_key(puzzle_type, grid.width, grid.height, grid.start, grid.end, cells,
+                                       broken_edges)
+        entry = self.entries.get(key)
+        in_memory = entry is not None
+        if not in_memory and key in self.store:
+            entry = self.store[key]
+        if entry is None or (all_answers and not entry[0]):
+            self.stats.misses += 1
+            return None
+        if in_memory:
+            self.stats.memory_hits += 1
+        else:
+            self.stats.disk_hits += 1
+        self._remember(key, entry)
+        return [[point_map(pt) for pt in path] for path in entry[1]]
+
+    def put(self, puzzle_type: str, grid, cells: CellGrid, broken_edges: set[PointPair],
+            paths: list[PointPath], complete: bool) -> None:
+        '''Store the answer paths of a panel. `complete` is False if they are only the first answers found.'''
+        key, point_map = canonical_key(puzzle_type, grid.width, grid.height, grid.start, grid.end, cells,
+                                       broken_edges)
+        entry = complete, [[point_map(pt) for pt in path] for path in paths]
+        self.store[key] = entry
+        self.store.sync()
+        self._remember(key, entry)
+
+    def _remember(self, key: str, entry: tuple[bool, list[PointPath]]) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def close(self) -> None:
+        self.store.close()
+
+    def report(self) -> str:
+        hits = self.stats.memory_hits + self.stats.disk_hits
+        lookups = hits + self.stats.misses
+        hit_rate = hits / lookups if lookups else 0.0
+        return (f'Solution memo: {len(self.entries)} in memory, {len(self.store)} on disk, {self.stats.memory_hits} '
+                f'memory hits, {self.stats.disk_hits} disk hits, {self.stats.misses} misses ({hit_rate:.0%} hit rate), '
+                f'{self.stats.evictions} evictions')
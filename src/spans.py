@@ -0,0 +1,146 @@
+# Hierarchical timing spans. A span times a block of code (wall and CPU time) and remembers which spans it was nested
+# in, so 'solve' inside 'proc img' inside 'total' is kept apart from a 'solve' anywhere else.
+#
+#     with spans.span('proc img'):
+#         ...
+#
+#     @spans.traced()
+#     def calc_paths(...):
+#
+# Durations are collected per nesting path over every solve of the session and reported as count, p50, p95 and max (see
+# Tracer.report()). Finished spans can also be written as Chrome trace events (chrome://tracing, Perfetto) with
+# Tracer.export_chrome().
+#
+# When tracing is off (cfg.TRACE), span() hands back one shared do-nothing context manager and traced() calls straight
+# through, so the cost is a function call and an attribute check.
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+import cfg
+
+MAX_EVENTS = 100_000  # finished spans kept for the Chrome trace. Statistics keep counting past this.
+
+_NULL_SPAN = contextlib.nullcontext()
+
+SpanPath = tuple[str, ...]  # names of the span and every span it is nested in, outermost first
+
+
+@dataclass
+class SpanStats:
+    walls: list[float] = field(default_factory=list)  # seconds
+    cpus: list[float] = field(default_factory=list)  # seconds of CPU time of the span's thread
+
+
+@dataclass
+class Event:
+    path: SpanPath
+    start: float  # perf_counter() seconds
+    wall: float
+    cpu: float
+    thread: int
+
+
+def percentile(values: list[float], q: float) -> float:
+    '''Nearest-rank percentile, `q` in 0..100'''
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))  # ceil
+    return ordered[int(rank) - 1]
+
+
+class Tracer:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stats: dict[SpanPath, SpanStats] = {}  # in order of first start, so parents come before their children
+        self.events: list[Event] = []
+        self.local = threading.local()  # stack of open span names, per thread
+
+    def span(self, name: str):
+        '''Context manager that times the block as a span nested in the spans open on this thread'''
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name)
+
+    @contextlib.contextmanager
+    def _span(self, name: str):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append(name)
+        path = tuple(stack)
+        stats = self.stats.setdefault(path, SpanStats())
+        start_cpu = time.thread_time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.thread_time() - start_cpu
+            stack.pop()
+            stats.walls.append(wall)
+            stats.cpus.append(cpu)
+            if len(self.events) < MAX_EVENTS:
+                self.events.append(Event(path, start, wall, cpu, threading.get_ident()))
+
+    def reset(self) -> None:
+        self.stats = {}
+        self.events = []
+
+    def report(self) -> str:
+        '''Table of the statistics of every span, nested under its parents'''
+        stats = dict(list(self.stats.items()))  # snapshot, other threads (cache warm-up) can still add spans
+        order = {path: idx for idx, path in enumerate(stats)}
+        paths = sorted(stats, key=lambda p: tuple(order.get(p[:i + 1], -1) for i in range(len(p))))
+        lines = [f'{"span":<36}{"count":>7}{"p50":>10}{"p95":>10}{"max":>10}{"cpu p50":>10}']
+        for path in paths:
+            s = stats[path]
+            walls, cpus = list(s.walls), list(s.cpus)
+            if not walls:
+                continue  # still open
+            label = '  ' * (len(path) - 1) + path[-1]
+            lines.append(f'{label:<36}{len(walls):>7}{percentile(walls, 50):>9.3f}s{percentile(walls, 95):>9.3f}s'
+                         f'{max(walls):>9.3f}s{percentile(cpus, 50):>9.3f}s')
+        return '\n'.join(lines)
+
+    def export_chrome(self, trace_file: str) -> None:
+        '''Write the finished spans as Chrome trace-event JSON ("complete" events, times in microseconds)'''
+        pid = os.getpid()
+        events = [{
+            'name': e.path[-1],
+            'cat': 'span',
+            'ph': 'X',
+            'ts': e.start * 1e6,
+            'dur': e.wall * 1e6,
+            'pid': pid,
+            'tid': e.thread,
+            'args': {'path': ' > '.join(e.path), 'cpu_ms': e.cpu * 1e3},
+        } for e in self.events]
+        with open(trace_file, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+TRACER = Tracer(cfg.TRACE)
+
+
+def span(name: str):
+    '''Time a block as a span of the session tracer'''
+    return TRACER.span(name)
+
+
+def traced(name: str | None = None):
+    '''Decorator that times every call of a function as a span (named after the function by default). Not for
+    generators, only their creation would be timed.'''
+    def decorate(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return fn(*args, **kwargs)
+            with TRACER.span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -1,6 +1,29 @@
 import copy
+import pickle
+import numpy as np
+import pytest
 import puzzle
+import bitgrid
+import constraints
+import tri_index
+import region_index
+import path_cache
+import cache_manager
+import parallel_filter
+import meet_middle
+import solution_cache
+import zdd
+import import_report
+import benchmark
+import spans
+import profiling
+import batch
+import runner
+import img_parsing
+from PIL import Image, ImageDraw
+import json
 import cfg
+import utils
 
 
 assert cfg.DEBUG == True  # DEBUG must be True for tests to pass
@@ -51,6 +74,26 @@ def test_traversal():
     assert len(grids) == 17
 
 
+def test_traversal_matches_valid_moves():
+    grid = puzzle.Grid(3, 4)
+    grid.delete_edges_from_path({frozenset(((1, 1), (2, 1)))})
+
+    def recurse(g, cur_point):
+        results = []
+        for pt in g.valid_moves(cur_point):
+            g2 = copy.deepcopy(g)
+            g2.add_link(cur_point, pt)
+            results.append(g2)
+            results.extend(recurse(g2, pt))
+        return results
+
+    expected = recurse(grid, grid.start)
+    grids = grid.find_all_paths(grid.start)
+    assert [g.path for g in grids] == [g.path for g in expected]
+    assert [g.edges for g in grids] == [g.edges for g in expected]
+    assert list(grid.walk_paths(grid.start)) == [tuple(g.path) for g in expected]
+
+
 def test_overlay():
     grid = puzzle.Grid(3, 3)
     over = tuple((
@@ -190,3 +233,650 @@ def test_region_puzzle_5x5_3_color():
     assert len(grids_with_paths) == 153744
     assert len(grids_with_complete_paths) == 8512
     assert len(ans) == 14
+
+
+def test_iter_paths_is_lazy():
+    grid = puzzle.Grid(4, 4)
+    paths = grid.iter_paths()
+    first = next(paths)
+    assert first.path[0] == grid.start
+    assert first.path[-1] == grid.end
+
+    _, grids_with_complete_paths = grid.calc_paths()
+    assert [g.path for g in grid.iter_paths()] == [g.path for g in grids_with_complete_paths]
+
+
+def test_iter_solutions():
+    grid = puzzle.Grid(4, 4)
+    grid.set_cells(tuple((
+        ('3', ' ', ' '),
+        (' ', ' ', '2'),
+        (' ', ' ', '1'),
+    )))
+    ans = list(grid.iter_solutions(puzzle.Grid.is_solved_tri_puzzle))
+    assert len(ans) == 2
+    assert all(g.cells == grid.cells for g in ans)
+
+
+def test_bit_grid_make_grid():
+    assert str(bitgrid.BitGrid(3, 4)) == str(puzzle.Grid(3, 4))
+
+
+def test_bit_grid_path():
+    grid = bitgrid.BitGrid(3, 3)
+    a, b, c = (1, 1), (2, 1), (2, 0)
+    grid.edges[frozenset((a, b))] = True
+    grid.edges[frozenset((b, c))] = True
+    assert grid.valid_moves((1, 2)) == [(2, 2), (0, 2)]
+    txt = str(grid)
+    assert txt == '''
++-+-^
+| | X
++-+X+
+| | |
+O-+-+
+Path: [(0, 2)]
+    '''.strip()
+
+
+def test_bit_grid_deepcopy():
+    grid = bitgrid.BitGrid(3, 3)
+    a, b, c, d = (1, 1), (2, 1), (2, 2), (0, 1)
+    grid.edges[frozenset((a, b))] = True
+    grid.edges[frozenset((b, c))] = True
+
+    grid2 = copy.deepcopy(grid)
+    grid2.edges[frozenset((a, d))] = True
+
+    assert len([v for k, v in grid.edges.items() if v]) == 2
+    assert len([v for k, v in grid2.edges.items() if v]) == 3
+
+
+def test_bit_grid_pickle():
+    grid = bitgrid.BitGrid(4, 4)
+    grid.append_to_path((1, 3))
+    grid.delete_edges_from_path({frozenset(((2, 2), (2, 1)))})
+    grid2 = pickle.loads(pickle.dumps(grid))
+    assert grid2.table is grid.table
+    assert str(grid2) == str(grid)
+
+
+def test_traversal_matches_frozenset_backend():
+    edges_to_del = {frozenset(((1, 1), (2, 1))), frozenset(((3, 3), (3, 2)))}
+    grid = puzzle.Grid(4, 4)
+    grid.delete_edges_from_path(edges_to_del)
+    bit_grid = bitgrid.BitGrid(4, 4)
+    bit_grid.delete_edges_from_path(edges_to_del)
+
+    grids = grid.find_all_paths(grid.start)
+    bit_grids = bit_grid.find_all_paths(bit_grid.start)
+    assert [g.path for g in bit_grids] == [g.path for g in grids]
+    assert [dict(g.edges) for g in bit_grids] == [g.edges for g in grids]
+
+
+def test_puzzles_match_frozenset_backend():
+    tri_cells = tuple((
+        ('3', ' ', ' '),
+        (' ', ' ', '2'),
+        (' ', ' ', '1'),
+    ))
+    region_cells = tuple((
+        ('w', 'w', 'b'),
+        ('w', 'b', ' '),
+        (' ', 'b', 'w'),
+    ))
+    edges_to_del = {frozenset(((0, 1), (1, 1)))}
+
+    answers = []
+    for cls in (puzzle.Grid, bitgrid.BitGrid):
+        _, grids_with_complete_paths = cls(4, 4).calc_paths()
+        tri, region = [], []
+        for g in grids_with_complete_paths:
+            g.set_cells(tri_cells)
+            if g.is_solved_tri_puzzle():
+                tri.append(g.path)
+            g.set_cells(region_cells)
+            if g.is_solved_region_puzzle(edges_to_del):
+                region.append(g.path)
+        answers.append((tri, region))
+
+    assert len(answers[0][0]) == 2
+    assert answers[0] == answers[1]
+
+
+def test_label_regions_match_frozenset_backend():
+    edges_to_del = {frozenset(((1, 1), (1, 2))), frozenset(((2, 3), (2, 2)))}
+    grid = puzzle.Grid(4, 4)
+    grid.delete_edges_from_path(edges_to_del)
+    bit_grid = bitgrid.BitGrid(4, 4)
+    bit_grid.delete_edges_from_path(edges_to_del)
+    for g, bit_g in zip(grid.find_all_paths(grid.start), bit_grid.find_all_paths(bit_grid.start)):
+        assert bit_g.label_regions() == g.label_regions()
+
+
+def test_tri_puzzle_pruned_search():
+    grid = puzzle.Grid(5, 5)
+    _, grids_with_complete_paths = grid.calc_paths()
+    grid.set_cells(tuple((
+        ('3', ' ', ' ', ' '),
+        (' ', ' ', '2', '1'),
+        (' ', ' ', '1', ' '),
+        ('2', ' ', '1', ' '),
+    )))
+
+    expected = [g.path for g in grid.iter_solutions(puzzle.Grid.is_solved_tri_puzzle, grids_with_complete_paths)]
+    ans = [g.path for g in grid.iter_paths(constraints.TriangleConstraint(grid))]
+    assert len(ans) == 9
+    assert ans == expected
+
+
+def test_tri_puzzle_pruned_search_large():
+    # cells made from a known 7x7 path, too large to enumerate every path
+    path = [(0, 6), (0, 5), (1, 5), (1, 6), (2, 6), (3, 6), (3, 5), (2, 5), (2, 4), (1, 4), (0, 4), (0, 3), (0, 2),
+            (1, 2), (1, 3), (2, 3), (3, 3), (3, 4), (4, 4), (5, 4), (5, 5), (4, 5), (4, 6), (5, 6), (6, 6), (6, 5),
+            (6, 4), (6, 3), (5, 3), (4, 3), (4, 2), (3, 2), (2, 2), (2, 1), (1, 1), (0, 1), (0, 0), (1, 0), (2, 0),
+            (3, 0), (3, 1), (4, 1), (5, 1), (5, 2), (6, 2), (6, 1), (6, 0)]
+    solved = puzzle.Grid(7, 7)
+    for pt in path[1:]:
+        solved.append_to_path(pt)
+    cells = tuple(tuple(str(solved.touching_edges(x, y)) if (x + y) % 2 == 0 else ' ' for x in range(6)) for y in range(6))
+
+    grid = puzzle.Grid(7, 7)
+    grid.set_cells(cells)
+    ans = list(grid.iter_paths(constraints.TriangleConstraint(grid)))
+    assert path in [g.path for g in ans]
+    assert all(g.is_solved_tri_puzzle() for g in ans)
+
+
+def test_meet_middle_matches_depth_first():
+    grid = puzzle.Grid(4, 4)
+    grid.delete_edges_from_path({frozenset(((1, 1), (2, 1)))})
+    expected = [g.path for g in grid.iter_paths()]
+    ans = [g.path for g in meet_middle.iter_paths(grid)]
+    assert len(ans) == len(expected)
+    assert sorted(ans) == sorted(expected)
+
+
+def test_meet_middle_tri_puzzle():
+    grid = puzzle.Grid(5, 5)
+    grid.set_cells(tuple((
+        ('3', ' ', ' ', ' '),
+        (' ', ' ', '2', '1'),
+        (' ', ' ', '1', ' '),
+        ('2', ' ', '1', ' '),
+    )))
+    expected = [g.path for g in grid.iter_paths(constraints.TriangleConstraint(grid))]
+    ans = [g.path for g in meet_middle.iter_paths(grid, meet_middle.TriangleCounts(grid), puzzle.Grid.is_solved_tri_puzzle)]
+    assert sorted(ans) == sorted(expected)
+
+
+def test_meet_middle_large_grid():
+    # 66 points: the point masks no longer fit a uint64
+    grid = puzzle.Grid(33, 2)
+    grid.delete_edges_from_path({frozenset(((x, 0), (x, 1))) for x in range(33) if x not in (0, 16, 32)})
+    expected = [g.path for g in grid.iter_paths()]
+    ans = [g.path for g in meet_middle.iter_paths(grid)]
+    assert len(ans) == 4
+    assert sorted(ans) == sorted(expected)
+
+
+def test_region_puzzle_pruned_search():
+    grid = puzzle.Grid(5, 5)
+    _, grids_with_complete_paths = grid.calc_paths()
+    grid.set_cells(tuple((
+        ('b', ' ', 'w', 'w'),
+        ('r', 'r', ' ', 'w'),
+        (' ', 'w', ' ', ' '),
+        (' ', ' ', 'w', 'b'),
+    )))
+
+    is_solved = lambda g: g.is_solved_region_puzzle(set())
+    expected = [g.path for g in grid.iter_solutions(is_solved, grids_with_complete_paths)]
+    ans = [g.path for g in grid.iter_paths(constraints.RegionConstraint(grid))]
+    assert len(ans) == 14
+    assert ans == expected
+
+
+def test_search_without_broken_edges():
+    # deleting the broken edges and searching what remains finds the same answers as filtering the full grid's paths
+    cells = tuple((
+        ('b', ' ', 'w', 'w'),
+        ('r', 'r', ' ', 'w'),
+        (' ', 'w', ' ', ' '),
+        (' ', ' ', 'w', 'b'),
+    ))
+    broken_edges = {frozenset(((1, 1), (2, 1))), frozenset(((2, 3), (2, 4))), frozenset(((3, 2), (4, 2)))}
+    full_grid = puzzle.Grid(5, 5)
+    full_grid.set_cells(cells)
+    _, grids_with_complete_paths = full_grid.calc_paths()
+    is_solved = lambda g: g.is_solved_region_puzzle(broken_edges)
+    expected = [g.path for g in full_grid.iter_solutions(is_solved, grids_with_complete_paths)]
+
+    grid = puzzle.Grid(5, 5)
+    grid.set_cells(cells)
+    grid.delete_edges_from_path(broken_edges)
+    ans = [g.path for g in grid.iter_paths(constraints.RegionConstraint(grid))]
+    assert len(ans) > 0
+    assert ans == expected
+
+
+def test_zdd_counts():
+    assert [zdd.PathZdd.build(puzzle.Grid(n, n)).count() for n in range(2, 8)] == [2, 12, 184, 8512, 1262816, 575780564]
+
+
+def test_zdd_paths():
+    edges_to_del = {frozenset(((1, 1), (2, 1))), frozenset(((3, 3), (3, 2)))}
+    grid = puzzle.Grid(4, 4)
+    diagram = zdd.PathZdd.build(grid)
+    assert sorted(diagram.paths()) == sorted(g.path for g in grid.iter_paths())
+
+    grid.delete_edges_from_path(edges_to_del)
+    expected = sorted(g.path for g in grid.iter_paths())
+    assert sorted(diagram.without_edges(edges_to_del).paths()) == expected
+    assert sorted(zdd.PathZdd.build(grid).paths()) == expected
+
+
+def test_zdd_tri_puzzle():
+    cells = tuple((
+        ('3', ' ', ' ', ' '),
+        (' ', ' ', '2', '1'),
+        (' ', ' ', '1', ' '),
+        ('2', ' ', '1', ' '),
+    ))
+    grid = puzzle.Grid(5, 5)
+    grid.set_cells(cells)
+    diagram = zdd.PathZdd.build(grid).with_triangles(cells)
+    assert diagram.count() == 9
+    assert sorted(diagram.paths()) == sorted(g.path for g in grid.iter_paths(constraints.TriangleConstraint(grid)))
+
+
+def test_label_regions():
+    g = puzzle.Grid(4, 3)
+    g.append_to_path((1, 2))
+    g.append_to_path((1, 1))
+    g.append_to_path((2, 1))
+    g.append_to_path((2, 0))
+    assert g.label_regions() == [
+        [0, 0, 1],
+        [0, 1, 1],
+    ]
+
+
+def test_region_growth_through_missing_edge():
+    g = puzzle.Grid(4, 4)
+    g.delete_edges_from_path({frozenset(((1, 1), (1, 2))), frozenset(((2, 3), (2, 2)))})
+    assert g.label_regions() == [[0, 0, 0]] * 3
+    assert len(g.get_regions_wrapper().regions) == 1
+
+
+def test_path_cache(tmp_path):
+    cache_file = str(tmp_path / 'grid_4x4.paths.bin')
+    grid = puzzle.Grid(4, 4)
+    grid.calc_paths(cache_file)
+    cached_paths, cached_complete_paths = grid.calc_paths(cache_file)
+    grids_with_paths, grids_with_complete_paths = grid.calc_paths()
+
+    assert len(cached_paths) == 2110
+    assert len(cached_complete_paths) == 184
+    assert [g.path for g in cached_paths] == [g.path for g in grids_with_paths]
+    assert [g.edges for g in cached_complete_paths] == [g.edges for g in grids_with_complete_paths]
+    assert str(cached_complete_paths[-1]) == str(grids_with_complete_paths[-1])
+
+
+def test_parallel_path_cache_matches_serial(tmp_path):
+    serial_file, parallel_file = tmp_path / 'serial.paths.bin', tmp_path / 'parallel.paths.bin'
+    grid = puzzle.Grid(4, 4)
+    grid.calc_paths(str(serial_file))
+    grids_with_paths, grids_with_complete_paths = grid.calc_paths(str(parallel_file), workers=2)
+
+    assert parallel_file.read_bytes() == serial_file.read_bytes()
+    assert len(grids_with_paths) == 2110
+    assert len(grids_with_complete_paths) == 184
+    assert grids_with_paths[5].path == grid.find_all_paths(grid.start)[5].path
+
+
+def test_triangle_index(tmp_path):
+    cache_file = str(tmp_path / 'grid_5x5.paths.bin')
+    grid = puzzle.Grid(5, 5)
+    _, grids_with_complete_paths = grid.calc_paths(cache_file)
+    index = tri_index.load_or_build(cache_file, grid, grids_with_complete_paths)
+    loaded = tri_index.load_or_build(cache_file, grid, grids_with_complete_paths)
+    assert loaded.bitsets == index.bitsets
+
+    cells = tuple((
+        (' ', ' ', ' ', ' '),
+        (' ', ' ', ' ', '1'),
+        ('2', ' ', '1', '1'),
+        (' ', '1', '2', ' '),
+    ))
+    grid.set_cells(cells)
+    expected = [g.path for g in grid.iter_solutions(puzzle.Grid.is_solved_tri_puzzle, grids_with_complete_paths)]
+    assert [grids_with_complete_paths[i].path for i in loaded.lookup(cells)] == expected
+    assert len(expected) == 22
+
+
+def test_region_index(tmp_path):
+    cache_file = str(tmp_path / 'grid_5x5.paths.bin')
+    grid = puzzle.Grid(5, 5)
+    _, grids_with_complete_paths = grid.calc_paths(cache_file)
+    region_index.load_or_build(cache_file, grid, grids_with_complete_paths)
+    index = region_index.load_or_build(cache_file, grid, grids_with_complete_paths)
+    assert index.labels.shape == (8512, 16)
+
+    cells = tuple((
+        ('b', ' ', 'w', 'w'),
+        ('r', 'r', ' ', 'w'),
+        (' ', 'w', ' ', ' '),
+        (' ', ' ', 'w', 'b'),
+    ))
+    grid.set_cells(cells)
+    is_solved = lambda g: g.is_solved_region_puzzle(set())
+    expected = [g.path for g in grid.iter_solutions(is_solved, grids_with_complete_paths)]
+    assert [grids_with_complete_paths[i].path for i in index.solved_ids(cells)] == expected
+    assert len(expected) == 14
+
+
+def test_drawable_ids():
+    grid = puzzle.Grid(4, 4)
+    _, grids_with_complete_paths = grid.calc_paths()
+    edges_to_del = {frozenset(((0, 3), (1, 3))), frozenset(((1, 1), (1, 2)))}
+
+    edges = path_cache.edge_matrix(grid, grids_with_complete_paths)
+    path_ids = path_cache.drawable_ids(grid, edges, edges_to_del)
+    expected = [idx for idx, g in enumerate(grids_with_complete_paths)
+                if not any(frozenset(pair) in edges_to_del for pair in zip(g.path, g.path[1:]))]
+    assert list(path_ids) == expected
+    assert 0 < len(expected) < 184
+    assert len(path_cache.drawable_ids(grid, edges, set())) == 184
+
+
+def test_cache_manager(tmp_path):
+    caches = cache_manager.CacheManager(str(tmp_path), max_bytes=1)  # only the last used entry stays resident
+
+    def get(*args, **kwargs):
+        entry = caches.get(*args, **kwargs)
+        entry.tri_idx, entry.region_idx  # the budget counts the indexes, wait for them
+        return entry
+
+    cache = get(4, 4)
+    assert len(cache.grids_with_complete_paths) == 184
+    assert get(4, 4) is cache
+    assert len(get(3, 4).grids_with_complete_paths) > 0
+    assert len(get(3, 3, start=(0, 0), end=(2, 2)).grids_with_complete_paths) == 12
+    assert list(caches.entries) == [(3, 3, (0, 0), (2, 2))]
+    assert get(4, 4) is not cache  # reloaded from disk after eviction
+
+    assert (caches.stats.hits, caches.stats.misses, caches.stats.evictions) == (1, 4, 3)
+    assert (tmp_path / 'grid_4x4.paths.bin').exists()
+    assert (tmp_path / 'grid_3x3_0-0_2-2.paths.bin').exists()
+
+
+def test_cache_manager_evicts_when_indexes_load(tmp_path):
+    caches = cache_manager.CacheManager(str(tmp_path), max_bytes=1)
+    caches.get(3, 3)
+    caches.get(4, 4)  # the 3x3 indexes may not be loaded yet, so the budget can still look met here
+    caches.index_loader.shutdown(wait=True)  # every index loaded and its eviction check run
+    assert list(caches.entries) == [(4, 4, (0, 3), (3, 0))]
+    assert caches.mapped_bytes() == (tmp_path / 'grid_4x4.paths.bin').stat().st_size
+
+
+def test_parallel_filter(tmp_path, monkeypatch):
+    monkeypatch.setattr(parallel_filter, 'CHUNK_SIZE', 10)  # many chunks, finishing in any order
+    cache = cache_manager.CacheManager(str(tmp_path)).get(4, 4)
+    cells = tuple((
+        ('w', 'w', 'b'),
+        ('w', 'b', ' '),
+        (' ', 'b', 'w'),
+    ))
+    path_ids = np.arange(len(cache.grids_with_complete_paths))
+    pool = parallel_filter.FilterPool(2)
+    try:
+        solved = pool.filter(cache, path_ids, cells, set(), is_tri_puzzle=False, first_only=False)
+        assert list(solved) == list(cache.region_idx.solved_ids(cells))
+        for _ in range(3):
+            first = pool.filter(cache, path_ids, cells, set(), is_tri_puzzle=False, first_only=True)
+            assert list(first) == [solved[0]]  # the lowest id, as the serial search and the indexes give
+    finally:
+        pool.close()
+
+
+def test_solution_cache(tmp_path):
+    store_file = str(tmp_path / 'solutions.memo')
+    cells = tuple((
+        ('w', 'w', 'b'),
+        ('w', 'b', ' '),
+        (' ', 'b', 'w'),
+    ))
+    grid = puzzle.Grid(4, 4)
+    grid.set_cells(cells)
+    path = next(grid.iter_solutions(lambda g: g.is_solved_region_puzzle(set()))).path
+
+    memo = solution_cache.SolutionCache(store_file)
+    assert memo.get('RegionColorTriplet', grid, cells, set()) is None
+    memo.put('RegionColorTriplet', grid, cells, set(), [path], complete=False)
+    assert memo.get('RegionColorTriplet', grid, cells, set()) == [path]
+    assert memo.get('RegionColorTriplet', grid, cells, set(), all_answers=True) is None  # only the first answer
+    assert memo.get('Triangle', grid, cells, set()) is None
+    memo.close()
+
+    # the panel mirrored over the diagonal from start to end is answered with the mirrored path, from disk
+    point_map, cell_map = solution_cache.symmetries(4, 4, grid.start, grid.end)[1]
+    mirrored_cells, _ = solution_cache.transform_panel(cells, set(), point_map, cell_map)
+    memo = solution_cache.SolutionCache(store_file)
+    (mirrored_path,) = memo.get('RegionColorTriplet', grid, mirrored_cells, set())
+    assert mirrored_path == [point_map(pt) for pt in path]
+    mirrored = grid.copy_with_path(mirrored_path)
+    mirrored.set_cells(mirrored_cells)
+    assert mirrored.is_solved_region_puzzle(set())
+    assert (memo.stats.disk_hits, memo.stats.misses) == (1, 0)
+    memo.put('RegionColorTriplet', grid, mirrored_cells, set(), [mirrored_path], complete=True)
+    assert memo.get('RegionColorTriplet', grid, cells, set(), all_answers=True) == [path]
+    memo.close()
+
+
+def test_cache_manager_warm_up(tmp_path):
+    caches = cache_manager.CacheManager(str(tmp_path))
+    future = caches.warm_up(4, 4)
+    cache = caches.get(4, 4)  # waits for the background load, whichever thread gets to it first
+    assert future.result() is cache
+    assert cache.tri_idx.num_paths == len(cache.region_idx.labels) == 184
+    assert caches.stats.misses == 1
+    assert (tmp_path / 'grid_4x4.paths.tri').exists()
+
+
+def test_lazy_imports():
+    times = import_report.measure('runner')
+    loaded = {t.name for t in times}
+    assert 'runner' in loaded
+    assert not loaded & set(import_report.LAZY_MODULES)
+
+
+def test_benchmark_compare():
+    assert benchmark.fit_cells(puzzle.DEMO_REGION_CELLS, 3) == (('b', ' '), ('w', ' '))
+    assert len(benchmark.fit_cells(puzzle.DEMO_REGION_CELLS, 6)[4]) == 5
+
+    results = benchmark.run_suite(sizes=(3,), runs=2, only=['find_all_paths', 'is_solved_tri_puzzle'])
+    assert set(results['results']) == {'find_all_paths/3x3', 'is_solved_tri_puzzle/3x3'}
+    assert benchmark.compare(results, results) == []
+
+    # a baseline that was twice as fast fails, one that was twice as slow does not
+    machine = {'platform': results['platform'], 'python': results['python']}
+    faster = {**machine, 'results': {k: {'median': r['min'] / 2} for k, r in results['results'].items()}}
+    slower = {**machine, 'results': {k: {'median': r['max'] * 2} for k, r in results['results'].items()}}
+    assert benchmark.compare(results, faster) == list(results['results'])
+    assert benchmark.compare(results, slower) == []
+
+    # timings from another machine are not compared
+    with pytest.raises(RuntimeError, match='Re-record'):
+        benchmark.compare(results, {**faster, 'platform': 'Windows-10-10.0.19045-SP0'})
+
+
+def test_spans(tmp_path):
+    tracer = spans.Tracer()
+    for _ in range(3):
+        with tracer.span('total'):
+            with tracer.span('get img'):
+                pass
+            with tracer.span('solve'):
+                with tracer.span('calc'):
+                    pass
+    with tracer.span('solve'):
+        pass
+    assert list(tracer.stats) == [('total',), ('total', 'get img'), ('total', 'solve'), ('total', 'solve', 'calc'),
+                                  ('solve',)]
+    assert len(tracer.stats[('total', 'solve', 'calc')].walls) == 3
+    rows = [line.split()[0] for line in tracer.report().splitlines()[1:]]
+    assert rows == ['total', 'get', 'solve', 'calc', 'solve']
+
+    trace_file = tmp_path / 'trace.json'
+    tracer.export_chrome(str(trace_file))
+    events = json.loads(trace_file.read_text())['traceEvents']
+    assert len(events) == 13 and all(e['ph'] == 'X' for e in events)
+    calc = next(e for e in events if e['name'] == 'calc')
+    parent = next(e for e in events if e['name'] == 'solve' and e['ts'] <= calc['ts'])
+    assert parent['ts'] + parent['dur'] >= calc['ts'] + calc['dur']
+
+    tracer = spans.Tracer(enabled=False)
+    with tracer.span('total'):
+        pass
+    assert tracer.stats == {} and tracer.events == []
+    assert spans.percentile([4.0, 1.0, 3.0, 2.0], 50) == 2.0
+    assert spans.percentile([4.0, 1.0, 3.0, 2.0], 95) == 4.0
+
+
+def test_profiling(tmp_path, capsys):
+    def work():
+        grid = puzzle.Grid(4, 4)
+        for g in grid.find_all_paths(grid.start):
+            copy.deepcopy(g)
+
+    out_prefix = str(tmp_path / 'profile')
+    with profiling.profile(out_prefix, 'sample'):
+        work()
+    lines = (tmp_path / 'profile.collapsed').read_text().splitlines()
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert any('copy.deepcopy' in line for line in lines)
+
+    with profiling.profile(out_prefix, 'cprofile'):
+        work()
+    assert (tmp_path / 'profile.prof').exists()
+    report = capsys.readouterr().out
+    assert 'Watched' in report and 'deepcopy' in report
+
+
+def test_batch(tmp_path, monkeypatch):
+    # workers=0 runs _init_worker() and _solve() in this process, which set these globals
+    for name in ('Puzzle', 'SHOW_DEBUG_IMG', 'GRID_BACKEND'):
+        monkeypatch.setattr(cfg, name, getattr(cfg, name))
+    Image.new('RGB', (cfg.SCREEN_WIDTH, cfg.SCREEN_HEIGHT)).save(tmp_path / 'a.png')
+    Image.new('RGB', (cfg.SCREEN_WIDTH, cfg.SCREEN_HEIGHT)).save(tmp_path / 'b.png')
+    (tmp_path / 'notes.txt').write_text('not an image')
+    assert batch.scan_dir(str(tmp_path), 'Triangle') == [('Triangle', str(tmp_path / 'a.png')),
+                                                          ('Triangle', str(tmp_path / 'b.png'))]
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text('# regression set\nTriangle, a.png\n\nTripletRegion,missing.png\n')
+    jobs = batch.read_manifest(str(manifest))
+    assert jobs == [('Triangle', str(tmp_path / 'a.png')), ('TripletRegion', str(tmp_path / 'missing.png'))]
+
+    def solve_image(img, caches):
+        with spans.span('solve'):
+            return (('1', ' '), (' ', '2')), {frozenset(((1, 0), (0, 0)))}, [[(0, 2), (1, 2), (2, 2), (2, 1), (2, 0)]]
+    monkeypatch.setattr(runner, 'solve_image', solve_image)
+
+    output = tmp_path / 'results.jsonl'
+    records = batch.run_batch(jobs, workers=0, cache_dir=None, output=str(output))
+    solved, missing = records
+    assert solved.error is None and missing.error is not None and 'missing.png' in missing.error
+    assert solved.cells == [['1', ' '], [' ', '2']]
+    assert solved.broken_edges == [[[0, 0], [1, 0]]]
+    assert solved.solutions == [[[0, 2], [1, 2], [2, 2], [2, 1], [2, 0]]]
+    assert {'load img', 'proc img', 'proc img > solve', 'total'} <= set(solved.timings)
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [line['image'] for line in lines] == [solved.image, missing.image]
+
+
+def test_batch_prepare_caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg, 'Puzzle', cfg.Puzzle)
+    monkeypatch.setattr(cfg.Triangle, 'GRID_SIZE', (3, 3))
+    batch.prepare_caches([('Triangle', 'a.png')], str(tmp_path), 0)
+    # the indexes are written too, so the workers do not each build them
+    assert sorted(f.name for f in tmp_path.iterdir()) == ['grid_3x3.paths.bin', 'grid_3x3.paths.regions.npy',
+                                                          'grid_3x3.paths.tri']
+
+
+def test_find_bounding_box(monkeypatch):
+    line = np.array([0, 1, 1, 1, 0, 1, 1, 1, 1, 0], dtype=np.uint8)
+    assert img_parsing.find_pattern(line, [0, 1, 1, 1]).tolist() == [0, 4]
+    assert img_parsing.find_pattern(line, [1, 1, 1, 0]).tolist() == [1, 6]
+    assert img_parsing.find_pattern(line[:3], [0, 1, 1, 1]).tolist() == []
+
+    # synthetic palettised screenshot: a panel border, plus a line left of the 23% that the left search must skip
+    monkeypatch.setattr(cfg, 'Puzzle', cfg.Triangle())
+    background, border = cfg.Puzzle.line_pattern()[:2]
+    img = Image.new('P', (cfg.SCREEN_WIDTH, cfg.SCREEN_HEIGHT), background)
+    img.putpalette(cfg.Puzzle.palette)
+    drw = ImageDraw.Draw(img)
+    drw.rectangle((300, 100, 800, 600), outline=border, width=14)
+    drw.line(((100, 0), (100, cfg.SCREEN_HEIGHT)), fill=border, width=6)
+    r = img_parsing.find_bounding_box(img)
+    # the pattern starts on the background pixel next to the border, and the box is shrunk by half a line width
+    assert r.as_tuple() == (299 + 7, 99 + 7, 801 - 7, 601 - 7)
+    x = int(cfg.Puzzle.PANEL_BOUNDING_BOX_WHISKER_START_X[0])
+    assert img.getpixel((x, 99 - 10)) == cfg.Puzzle.DEBUG_COLOR  # debug crosses are drawn on the image
+
+
+def test_preprocess_panel(monkeypatch):
+    rng = np.random.default_rng(0)
+    for config in (cfg.Region2ColorStarter, cfg.RegionColorTriplet, cfg.Triangle):
+        # synthetic screenshot: noisy palette colors, a panel of random blocks with a border and grid lines
+        monkeypatch.setattr(cfg, 'Puzzle', config())
+        palette = np.array(cfg.Puzzle.palette).reshape(-1, 3)
+        background, line = cfg.Puzzle.line_pattern()[:2]
+        colors = np.full((cfg.SCREEN_HEIGHT, cfg.SCREEN_WIDTH), background)
+        blocks = rng.integers(0, len(palette), (cfg.SCREEN_HEIGHT // 16, cfg.SCREEN_WIDTH // 16)).repeat(16, 0).repeat(16, 1)
+        colors[120:620, 300:780] = blocks[120:620, 300:780]
+        pixels = palette[colors] + rng.integers(-25, 25, (cfg.SCREEN_HEIGHT, cfg.SCREEN_WIDTH, 3))
+        img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+        drw = ImageDraw.Draw(img)
+        for k in range(5):
+            drw.line(((300 + 120 * k, 120), (300 + 120 * k, 620)), fill=tuple(palette[line]), width=14)
+            drw.line(((300, 120 + 125 * k), (780, 120 + 125 * k)), fill=tuple(palette[line]), width=14)
+
+        full = runner.preprocess_image(img)
+        full_box = img_parsing.find_bounding_box(full)
+        roi, roi_box = runner.preprocess_panel(img)
+        assert roi_box.as_tuple() == full_box.as_tuple()
+        assert roi.crop(roi_box.as_tuple()).tobytes() == full.crop(full_box.as_tuple()).tobytes()
+        assert img_parsing.get_puzzle_details(roi, roi_box) == img_parsing.get_puzzle_details(full, full_box)
+
+
+def test_atomic_write(tmp_path):
+    target = tmp_path / 'grid_5x5.paths.bin'
+    try:
+        with utils.atomic_write(str(target)) as fout:
+            fout.write(b'partial')
+            raise RuntimeError('writer died')
+    except RuntimeError:
+        pass
+    assert list(tmp_path.iterdir()) == []  # neither the file nor the temporary one is left behind
+
+    with utils.atomic_write(str(target)) as fout:
+        fout.write(b'complete')
+    assert target.read_bytes() == b'complete' and list(tmp_path.iterdir()) == [target]
+
+
+def test_find_solutions(tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg, 'Puzzle', cfg.Triangle())
+    monkeypatch.setattr(cfg, 'SHOW_DEBUG_IMG', True)  # every answer, not only the first
+    cells = ((' ', ' ', ' '), ('3', ' ', '2'), (' ', '1', ' '))
+    grid = puzzle.Grid(4, 4)
+    grid.set_cells(cells)
+    expected = sorted(g.path for g in grid.iter_solutions(puzzle.Grid.is_solved_tri_puzzle))
+    assert expected
+
+    # streamed from the grid, and looked up in the cache of its shape
+    streamed = runner.find_solutions(None, set(), cells, grid)
+    cache = cache_manager.CacheManager(str(tmp_path)).get(4, 4)
+    cached = runner.find_solutions(cache, set(), cells, grid)
+    assert sorted(g.path for g in streamed) == expected
+    assert sorted(g.path for g in cached) == expected
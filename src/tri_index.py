@@ -0,0 +1,120 @@
+# Inverted index from (cell, number of touching path edges) to the set of complete paths with that count.
+# Solving a Triangle puzzle becomes an intersection of a few bitsets instead of checking every cached path.
+#
+# File layout (little endian), stored next to the path cache (see path_cache.py):
+#   header:  magic b'WTI1', width, height (uint16 each), number of paths (uint32)
+#   bitsets: for every cell (row-major) and every count 0..4, a bitset of path ids, (number of paths + 7) // 8 bytes
+import struct
+from pathlib import Path
+from typing import Iterable, Iterator
+import bitgrid
+import path_cache
+import utils
+from typ import CellGrid, Point
+
+MAGIC = b'WTI1'
+HEADER = struct.Struct('<4s2HI')
+MAX_COUNT = 4
+
+
+class TriangleIndex:
+    def __init__(self, width: int, height: int, num_paths: int, bitsets: dict[tuple[Point, int], int]):
+        self.width = width
+        self.height = height
+        self.num_paths = num_paths
+        self.bitsets = bitsets
+
+    @staticmethod
+    def build(width: int, height: int, masks: Iterable[int]) -> 'TriangleIndex':
+        '''Build the index from the edge bitmasks of the complete paths (path id = position in `masks`)'''
+        table = bitgrid.edge_table(width, height)
+        cell_edges = list(table.cell_edges.items())
+        ids: dict[tuple[Point, int], list[int]] = {}
+        num_paths = 0
+        for path_id, mask in enumerate(masks):
+            for cell, edges in cell_edges:
+                ids.setdefault((cell, (mask & edges).bit_count()), []).append(path_id)
+            num_paths += 1
+
+        bitsets = {}
+        for cell in table.cell_edges:
+            for count in range(MAX_COUNT + 1):
+                bits = bytearray((num_paths + 7) // 8)
+                for path_id in ids.get((cell, count), ()):
+                    bits[path_id >> 3] |= 1 << (path_id & 7)
+                bitsets[(cell, count)] = int.from_bytes(bits, 'little')
+        return TriangleIndex(width, height, num_paths, bitsets)
+
+    def matches(self, cells: CellGrid) -> int:
+        '''Return the bitset of path ids that solve the given Triangle puzzle cells'''
+        selections = []
+        for y, row in enumerate(cells):
+            for x, cell in enumerate(row):
+                if cell != ' ':
+                    selections.append(self.bitsets[((x, y), int(cell))])
+        selections.sort(key=int.bit_count)  # most selective first, so the intersection empties out early
+
+        result = (1 << self.num_paths) - 1
+        for bits in selections:
+            result &= bits
+            if not result:
+                break
+        return result
+
+    def lookup(self, cells: CellGrid) -> list[int]:
+        '''Return the ids of the paths that solve the given Triangle puzzle cells'''
+        return list(iter_ids(self.matches(cells)))
+
+    def save(self, index_file: str) -> None:
+        size = (self.num_paths + 7) // 8
+        with utils.atomic_write(index_file) as fout:
+            fout.write(HEADER.pack(MAGIC, self.width, self.height, self.num_paths))
+            for y in range(self.height - 1):
+                for x in range(self.width - 1):
+                    for count in range(MAX_COUNT + 1):
+                        fout.write(self.bitsets[((x, y), count)].to_bytes(size, 'little'))
+
+    @staticmethod
+    def load(index_file: str) -> 'TriangleIndex':
+        data = Path(index_file).read_bytes()
+        magic, width, height, num_paths = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise RuntimeError(f'{index_file} is not a triangle index file')
+        size = (num_paths + 7) // 8
+        offset = HEADER.size
+        bitsets = {}
+        for y in range(height - 1):
+            for x in range(width - 1):
+                for count in range(MAX_COUNT + 1):
+                    bitsets[((x, y), count)] = int.from_bytes(data[offset:offset + size], 'little')
+                    offset += size
+        return TriangleIndex(width, height, num_paths, bitsets)
+
+
+def iter_ids(bits: int) -> Iterator[int]:
+    '''Yield the positions of the set bits, lowest first'''
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def index_file_for(cache_file: str) -> str:
+    return str(Path(cache_file).with_suffix('.tri'))
+
+
+def load_or_build(cache_file: str, grid, grids_with_complete_paths) -> TriangleIndex:
+    '''Load the index stored next to `cache_file`, or build it from the complete paths and store it there'''
+    index_file = index_file_for(cache_file)
+    if Path(index_file).exists():
+        print(f'Reading triangle index from {index_file}.')
+        index = TriangleIndex.load(index_file)
+        if (index.width, index.height, index.num_paths) == (grid.width, grid.height, len(grids_with_complete_paths)):
+            return index
+        print('Triangle index does not match the path cache. Rebuilding it.')
+
+    print(f'Building triangle index and writing it to {index_file}')
+    index = TriangleIndex.build(grid.width, grid.height, path_cache.path_masks(grid, grids_with_complete_paths))
+    index.save(index_file)
+    return index
+
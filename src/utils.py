@@ -1,4 +1,5 @@
-import time
+import os
+import threading
 from contextlib import contextmanager
 
 from typ import Point, PointPair, GridEdges, PointPath, Region, Regions
@@ -25,9 +26,14 @@ def pt_lerp(p1, p2, u):
 
 
 @contextmanager
-def timer(msg:str):
-    start = time.time()
-    yield None
-    end = time.time()
-    dur = end - start
-    print(f'Elapsed: {msg} {dur:.3f}')
+def atomic_write(file_name: str):
+    '''Write a file through a temporary file next to it, which replaces `file_name` only once the block is done. Readers
+    never see a partly written file, and a writer that dies midway leaves no file behind.'''
+    tmp_name = f'{file_name}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_name, 'wb') as fout:
+            yield fout
+        os.replace(tmp_name, file_name)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
@@ -0,0 +1,258 @@
+# Zero-suppressed decision diagram (ZDD) of all simple paths from the start to the end of a grid, built with Knuth's
+# "simpath" frontier method.
+#
+# The edges of the grid are decided one at a time, in row-major order of their first point, so only the points
+# around one row of the grid (the frontier) are ever in between decided and undecided edges. The state of a partial
+# edge selection is the `mate` of every frontier point:
+#   mate[v] == v   v has no selected edge yet
+#   mate[v] == -1  v has two selected edges, nothing more can touch it
+#   mate[v] == u   v is one end of a path fragment whose other end is u
+# Partial selections that reach the same state at the same edge have the same completions, so they share one node.
+# That is what keeps the diagram small: the 575,780,564 paths of a 7x7 grid fit in about 8,000 nodes.
+#
+# Node 0 and 1 are the empty and the accepting terminal. Every other node decides the edge of its `level`: `lo` is
+# the node for the selections without that edge, `hi` the one for the selections with it. Selections are returned as
+# edge bitmasks in the bit order of bitgrid.EdgeTable, so path_cache.decode_path() turns them into points.
+import sys
+import time
+from typing import Iterator
+import bitgrid
+import path_cache
+import puzzle
+from typ import CellGrid, Point, PointPair
+
+
+class PathZdd:
+    def __init__(self, width: int, height: int, start: Point, end: Point, order: list[PointPair],
+                 level: list[int], lo: list[int], hi: list[int], root: int):
+        self.width = width
+        self.height = height
+        self.start = start
+        self.end = end
+        self.order = order  # edge decided at each level
+        table = bitgrid.edge_table(width, height)
+        self.bits = [table.edge_bit[edge] for edge in order]
+        self.level = level
+        self.lo = lo
+        self.hi = hi
+        self.root = root
+
+    @staticmethod
+    def build(grid) -> 'PathZdd':
+        '''Build the diagram of all paths from `grid.start` to `grid.end` over the edges of `grid` that exist'''
+        order = edge_order(grid)
+        return _build_simpath(grid.width, grid.height, grid.start, grid.end, order)
+
+    def __len__(self) -> int:
+        '''Number of nodes, terminals included'''
+        return len(self.level)
+
+    def count(self) -> int:
+        '''Number of paths in the diagram, without enumerating them'''
+        counts = [0, 1] + [0] * (len(self) - 2)
+        for node in range(2, len(self)):  # children always have lower ids than their parents
+            counts[node] = counts[self.lo[node]] + counts[self.hi[node]]
+        return counts[self.root]
+
+    def masks(self) -> Iterator[int]:
+        '''Yield the edge bitmask of every path in the diagram'''
+        stack = [(self.root, 0)]
+        while stack:
+            node, mask = stack.pop()
+            if node == 1:
+                yield mask
+            elif node != 0:
+                stack.append((self.hi[node], mask | self.bits[self.level[node]]))
+                stack.append((self.lo[node], mask))
+
+    def without_edges(self, edges_to_del: set[PointPair]) -> 'PathZdd':
+        '''Return the diagram of the paths that use none of `edges_to_del`'''
+        removed = {self.order.index(edge) for edge in edges_to_del if edge in self.order}
+        builder = _Builder()
+        new_ids = [0, 1]
+        for node in range(2, len(self)):
+            lo = new_ids[self.lo[node]]
+            hi = 0 if self.level[node] in removed else new_ids[self.hi[node]]
+            new_ids.append(builder.node(self.level[node], lo, hi))
+        return builder.finish(self, new_ids[self.root])
+
+    def with_triangles(self, cells: CellGrid) -> 'PathZdd':
+        '''Return the diagram of the paths that touch each numbered cell with exactly its number of edges'''
+        table = bitgrid.edge_table(self.width, self.height)
+        levels = {edge: lvl for lvl, edge in enumerate(self.order)}
+        cell_levels = []
+        goal = []
+        for y, row in enumerate(cells):
+            for x, cell in enumerate(row):
+                if cell != ' ':
+                    cell_levels.append({levels[e] for e in table.iter_edges(table.cell_edges[(x, y)]) if e in levels})
+                    goal.append(int(cell))
+        goal = tuple(goal)
+        num_levels = len(self.order)
+        # per level: which numbered cells the edge touches, and how many edges of each cell are still undecided
+        touches = [tuple(int(lvl in lvls) for lvls in cell_levels) for lvl in range(num_levels)]
+        undecided = [tuple(sum(1 for l in lvls if l >= lvl) for lvls in cell_levels) for lvl in range(num_levels)]
+
+        builder = _Builder()
+        memo: dict[tuple[int, tuple], int] = {}
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 2 * num_levels + 100))
+
+        def restrict(node: int, counts: tuple) -> int:
+            if node < 2:
+                return int(node == 1 and counts == goal)  # edges after the last decided one are not on the path
+            lvl = self.level[node]
+            if not all(c <= g <= c + left for c, g, left in zip(counts, goal, undecided[lvl])):
+                return 0
+            key = (node, counts)
+            if key not in memo:
+                lo = restrict(self.lo[node], counts)
+                hi = restrict(self.hi[node], tuple(c + t for c, t in zip(counts, touches[lvl])))
+                memo[key] = builder.node(lvl, lo, hi)
+            return memo[key]
+
+        return builder.finish(self, restrict(self.root, (0,) * len(goal)))
+
+    def paths(self) -> Iterator[list[Point]]:
+        '''Yield the points of every path in the diagram'''
+        table = bitgrid.edge_table(self.width, self.height)
+        for mask in self.masks():
+            yield path_cache.decode_path(table, self.start, mask)
+
+
+class _Builder:
+    '''Node store that merges equal nodes and drops nodes whose `hi` is the empty terminal'''
+    def __init__(self):
+        self.level = [sys.maxsize, sys.maxsize]
+        self.lo = [0, 1]
+        self.hi = [0, 1]
+        self.unique: dict[tuple[int, int, int], int] = {}
+
+    def node(self, level: int, lo: int, hi: int) -> int:
+        if hi == 0:
+            return lo
+        key = (level, lo, hi)
+        node = self.unique.get(key)
+        if node is None:
+            node = self.unique[key] = len(self.level)
+            self.level.append(level)
+            self.lo.append(lo)
+            self.hi.append(hi)
+        return node
+
+    def finish(self, like: PathZdd, root: int) -> PathZdd:
+        return PathZdd(like.width, like.height, like.start, like.end, like.order, self.level, self.lo, self.hi, root)
+
+
+def edge_order(grid) -> list[PointPair]:
+    '''Edges that exist in `grid`, in row-major order of their first point (right edge first, then down edge)'''
+    order = []
+    for y in range(grid.height):
+        for x in range(grid.width):
+            for d in ((1, 0), (0, 1)):
+                hop = x + d[0], y + d[1]
+                pair = frozenset(((x, y), hop))
+                if grid.edges.get(pair, True) == False:
+                    order.append(pair)
+    return order
+
+
+def _build_simpath(width: int, height: int, start: Point, end: Point, order: list[PointPair]) -> PathZdd:
+    '''Build the diagram top down, one level (edge) at a time, merging partial selections by frontier state. Then
+    reduce it bottom up.'''
+    def index(pt: Point) -> int:
+        return pt[1] * width + pt[0]
+
+    edges = [tuple(sorted(index(pt) for pt in edge)) for edge in order]
+    s, t = index(start), index(end)
+    last = {}  # level of the last edge of each point. The point leaves the frontier after it.
+    for lvl, (a, b) in enumerate(edges):
+        last[a] = last[b] = lvl
+
+    # Unreduced nodes. Children are always created after their parents.
+    raw_level, raw_lo, raw_hi = [sys.maxsize, sys.maxsize], [0, 1], [0, 1]
+
+    def child(mate: dict[int, int], lvl: int, leaving: list[int], next_level: dict[tuple, int]) -> int:
+        for v in leaving:
+            m = mate.pop(v)
+            if v in (s, t):
+                if m == v:
+                    return 0  # start and end must have one edge
+            elif m not in (v, -1):
+                return 0  # any other point has zero or two edges
+        if lvl + 1 == len(edges):
+            return 0  # start and end were never joined
+        state = tuple(sorted(mate.items()))
+        node = next_level.get(state)
+        if node is None:
+            node = next_level[state] = len(raw_level)
+            raw_level.append(lvl + 1)
+            raw_lo.append(0)
+            raw_hi.append(0)
+        return node
+
+    cur_level = {(): len(raw_level)}
+    raw_level.append(0)
+    raw_lo.append(0)
+    raw_hi.append(0)
+    for lvl, (a, b) in enumerate(edges):
+        leaving = [v for v in (a, b) if last[v] == lvl]
+        next_level: dict[tuple, int] = {}
+        for state, node in cur_level.items():
+            mate = dict(state)
+            mate.setdefault(a, a)
+            mate.setdefault(b, b)
+            raw_lo[node] = child(dict(mate), lvl, leaving, next_level)
+            raw_hi[node] = _add_edge(mate, a, b, s, t, lambda m: child(m, lvl, leaving, next_level))
+        cur_level = next_level
+
+    builder = _Builder()
+    new_ids = [0] * len(raw_level)
+    new_ids[1] = 1
+    for node in range(len(raw_level) - 1, 1, -1):
+        new_ids[node] = builder.node(raw_level[node], new_ids[raw_lo[node]], new_ids[raw_hi[node]])
+    return PathZdd(width, height, start, end, order, builder.level, builder.lo, builder.hi,
+                   new_ids[2] if edges else 0)
+
+
+def _add_edge(mate: dict[int, int], a: int, b: int, s: int, t: int, child) -> int:
+    '''Return the node for selecting the edge (a, b) on top of the frontier state `mate`'''
+    ma, mb = mate[a], mate[b]
+    if ma == -1 or mb == -1:
+        return 0  # a point would get a third edge
+    if (a in (s, t) and ma != a) or (b in (s, t) and mb != b):
+        return 0  # start and end only get one edge
+    if ma == b:
+        return 0  # closes a loop
+    # the fragments ending in a and b are joined. Their far ends (a or b itself when it had no edge) become the ends.
+    if ma != a:
+        mate[a] = -1
+    if mb != b:
+        mate[b] = -1
+    if ma in mate:
+        mate[ma] = mb
+    if mb in mate:
+        mate[mb] = ma
+    if {ma, mb} == {s, t}:
+        # the path is complete. Valid only if no other fragment is left over.
+        if any(m not in (v, -1) for v, m in mate.items() if v not in (ma, mb)):
+            return 0
+        return 1
+    return child(mate)
+
+
+def compare_counts(sizes=(3, 4, 5, 6, 7, 8)):
+    '''Build the diagram of each grid size and count its paths'''
+    print(f'{"grid":<6}{"nodes":>10}{"paths":>16}{"build":>10}{"count":>10}')
+    for size in sizes:
+        grid = puzzle.Grid(size, size)
+        s = time.perf_counter()
+        diagram = PathZdd.build(grid)
+        build = time.perf_counter() - s
+        s = time.perf_counter()
+        count = diagram.count()
+        counting = time.perf_counter() - s
+        print(f'{size}x{size:<4}{len(diagram):>10}{count:>16}{build:>9.3f}s{counting:>9.3f}s')
+
+
+if __name__ == '__main__':
+    compare_counts()